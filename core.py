@@ -4,6 +4,7 @@
 # modified by Thierry
 #
 #*****************************************************************************
+from packed_words import lcp
     
 class Core():
     """
@@ -14,6 +15,13 @@ class Core():
     Core(G,H) builds the Guirardel Core for the two MarkedGraph
     objects G and H.
 
+    If ``workers`` is an integer greater than 1, the slices of the
+    core are built in parallel by a pool of ``workers`` processes.
+
+    If ``build_slices`` is ``False``, the slices are not built as
+    ``GraphWithInverses``: only the volumes (and weighted volumes) of
+    the core are available.
+
     AUTHORS:
 
     - Matt Clay
@@ -21,7 +29,7 @@ class Core():
     """
 
     def __init__(self,domain,codomain,edge_map=None,inv_edge_map=None,vertex_map=None,\
-                 inv_vertex_map=None,consolidate=False):
+                 inv_vertex_map=None,consolidate=False,workers=None,build_slices=True):
         
         self._domain=domain
         self._codomain=codomain
@@ -36,9 +44,16 @@ class Core():
                              # signed_ends[x] = +- cylinder decomoposition of image of edge_map
         self._core_slice={} # dictionary: keys = edge labels of domain
                             # core_slice[x] = slice of the core above x as a GraphWithInverses
+        self._volume={} # dictionary: keys = edge labels of domain
+                        # volume[x] = number of edges of core_slice[x]
+        self._slice_count=None # numpy array: rows = edge labels of domain (in the order of _slice_row)
+                               # columns = positive letters of codomain (in the order of _count_column)
+                               # slice_count[x,a] = number of edges of core_slice[x] labeled by a or A
+        self._slice_row={}
+        self._count_column={}
 
         self._build_endmap(consolidate)
-        self._build_core()
+        self._build_core(workers,build_slices)
 
     def __str__(self):
         """
@@ -125,38 +140,55 @@ class Core():
                             for e in removed_ends: self._signed_ends[a].remove(e)
                             self._signed_ends[a].remove(p_opp)   
                             
-    def _build_core(self):
+    def _build_core(self,workers=None,build_slices=True):
         """
         Builds the core.  Called when Core is initialized.
+
+        The slice above each edge of the domain only depends on the
+        ends of this edge. If ``workers`` is an integer greater than 1,
+        the slices are computed by a pool of ``workers`` processes.
+
+        If ``build_slices`` is ``False`` only the number of edges of
+        each slice with a given label is recorded.
         """
+        import numpy
+
         ends={} # remove signs from ends
         for x in self._signed_ends.keys():
             ends[x]=[]
             for e in self._signed_ends[x]:
                 ends[x].append(e[1:] if e[0]=='-' else e)
         inv_alph=self._inv_graph_map.domain()._alphabet
-        
-        for x in self._graph_map.domain().edge_labels():
-            slice_x=GraphWithInverses(alphabet=inv_alph)
-            # find common prefix
-            if ends[x]: common=ends[x][0]
-            for e in ends[x]:
-                common_len=self._inv_graph_map.domain().common_prefix_length(e,common)
-                common=common[:common_len]
-            # build slice
-            for e in ends[x]:
-                v_label=common
-                for a in e[common_len:-1]:
-                    if v_label not in slice_x.vertices():
-                        slice_x.add_vertex(v_label)
-                    t_label=v_label+a
-                    if t_label not in slice_x.vertices():
-                        slice_x.add_vertex(t_label)
-                    edge=(v_label,t_label,a)
-                    if edge not in slice_x.edges():
-                        slice_x.add_edge(edge)
-                    v_label=t_label
-            self._core_slice[x]=slice_x
+
+        labels=self._graph_map.domain().edge_labels()
+        data=[tuple(ends[x]) for x in labels] # serialized end map
+
+        if workers is not None and workers>1 and len(data)>1:
+            from multiprocessing import Pool
+            pool=Pool(workers)
+            try:
+                slices=pool.map(_core_slice_edges,data)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            slices=map(_core_slice_edges,data)
+
+        self._count_column=dict((a,j) for j,a in enumerate(inv_alph.positive_letters()))
+        self._slice_count=numpy.zeros((len(labels),len(self._count_column)),dtype=int)
+        for i,(x,(vertices,edges)) in enumerate(zip(labels,slices)):
+            self._slice_row[x]=i
+            count=self._slice_count[i]
+            for edge in edges:
+                count[self._count_column[inv_alph.to_positive_letter(edge[2])]]+=1
+            self._volume[x]=len(edges)
+            if build_slices:
+                slice_x=GraphWithInverses(alphabet=inv_alph)
+                for v in vertices:
+                    slice_x.add_vertex(v)
+                for edge in edges:
+                    slice_x.add_edge(edge)
+                self._core_slice[x]=slice_x
 
     def end_map(self,e=None):
         """
@@ -230,10 +262,56 @@ class Core():
         specified. Else returns the volume of the core, i.e., the
         intersection number.
         """
-        if e==None or e not in self._core_slice.keys():
-            return sum(len(self._core_slice[x].edges()) for x in self._core_slice.keys()) # intersection number
+        if e==None or e not in self._volume:
+            return sum(self._volume.itervalues()) # intersection number
         else:
-            return len(self._core_slice[e].edges())
+            return self._volume[e]
+
+    def weighted_volume(self,e=None):
+        """
+        Returns the length-weighted volume of the slice of core above
+        ``e`` if specified. Else returns the weighted volume of the
+        core, i.e., the intersection number of the metric graphs.
+
+        Each edge of a slice above ``x`` labeled by ``a`` contributes
+        the product of the lengths of ``x`` and ``a``. Lengths are
+        taken from ``MarkedMetricGraph.length_vector()``, edges of a
+        graph which is not metric have length 1.
+
+        EXAMPLES::
+
+        sage: A=AlphabetWithInverses(3)
+        sage: phi=FreeGroupAutomorphism("a->ab,b->ac,c->a")
+        sage: G=MarkedMetricGraph.HNN_splitting(A)
+        sage: H=MarkedMetricGraph.HNN_splitting(A)
+        sage: H.precompose(phi)
+        sage: C=Core(G,H,build_slices=False)
+        sage: C.weighted_volume()<=C.volume()
+        True
+        """
+        import numpy
+
+        domain_length=self._length_vector(self._domain,self._slice_row)
+        codomain_length=self._length_vector(self._codomain,self._count_column)
+        if e is None or e not in self._slice_row:
+            return numpy.dot(domain_length,numpy.dot(self._slice_count,codomain_length))
+        else:
+            i=self._slice_row[e]
+            return domain_length[i]*numpy.dot(self._slice_count[i],codomain_length)
+
+    @staticmethod
+    def _length_vector(graph,index):
+        """
+        The NumPy vector of the lengths of the edges of ``graph``,
+        in the order given by the dictionary ``index`` from letters
+        to positions.
+        """
+        import numpy
+
+        letters=sorted(index,key=index.get)
+        if isinstance(graph,MarkedMetricGraph):
+            return graph.length_vector(letters)
+        return numpy.ones(len(letters))
 
     @staticmethod
     def rose_map(automorphism):
@@ -245,4 +323,195 @@ class Core():
         graph=GraphWithInverses.rose_graph(automorphism._domain._alphabet.copy())
         inv_automorphism=automorphism.inverse()
         return Core(graph,graph,automorphism,inv_automorphism)
+
+    @staticmethod
+    def rose_volumes(automorphism,n=None,workers=None):
+        """
+        Iterator over the volumes of the cores of the rose and the
+        rose acted upon by the powers ``automorphism**k`` for
+        ``k=1,2,...`` (up to ``n`` if specified).
+
+        The ``k+1``-th power and its inverse are computed from the
+        ``k``-th ones by substituting their images in the images of
+        ``automorphism`` and of its inverse, which is computed only
+        once. Only the current power is kept in memory.
+
+        EXAMPLES::
+
+        sage: phi=FreeGroupAutomorphism("a->ab,b->ac,c->a")
+        sage: volumes=list(Core.rose_volumes(phi,5))
+        sage: volumes[2]==Core.rose_map(phi**3).volume()
+        True
+        """
+        graph=GraphWithInverses.rose_graph(automorphism._domain._alphabet.copy())
+        inv_automorphism=automorphism.inverse()
+        phi=automorphism
+        psi=inv_automorphism
+        k=0
+        while n is None or k<n:
+            k+=1
+            yield Core(graph,graph,phi,psi,workers=workers).volume()
+            phi=phi*automorphism
+            psi=psi*inv_automorphism
+
+    @staticmethod
+    def growth_rate(automorphism,n=10):
+        """
+        An estimate of the exponential growth rate of the volumes of
+        the cores of the rose and the rose acted upon by
+        ``automorphism**k`` for ``k=1,...,n``.
+
+        The estimate is the exponential of the slope of the least
+        squares line of the logarithms of the volumes of the second
+        half of the sequence.
+
+        EXAMPLES::
+
+        sage: phi=FreeGroupAutomorphism("a->ab,b->ac,c->a")
+        sage: Core.growth_rate(phi,12)>1
+        True
+        """
+        from math import log,exp
+
+        volumes=list(Core.rose_volumes(automorphism,n))
+        points=[(k,log(volumes[k])) for k in xrange(len(volumes)//2,len(volumes)) if volumes[k]>0]
+        if len(points)<2:
+            return 1.0
+        m=len(points)
+        mean_k=sum(k for k,_ in points)/float(m)
+        mean_v=sum(v for _,v in points)/m
+        slope=sum((k-mean_k)*(v-mean_v) for k,v in points)/sum((k-mean_k)**2 for k,_ in points)
+        return exp(slope)
+
+    @staticmethod
+    def intersection_matrix(graphs,workers=None,verbose=False):
+        """
+        The symmetric matrix of the intersection numbers of the
+        ``MarkedGraph`` objects of the list ``graphs``.
+
+        The entry ``(i,j)`` is ``Core(graphs[i],graphs[j]).volume()``
+        and the diagonal is zero. The inverse of the marking of each
+        graph is computed only once, and only the pairs ``i<j`` are
+        computed.
+
+        If ``workers`` is an integer greater than 1, the pairs are
+        computed in parallel by a pool of ``workers`` processes.
+
+        If ``verbose`` is ``True``, prints the progress of the
+        computation.
+
+        EXAMPLES::
+
+        sage: phi=FreeGroupAutomorphism("a->ab,b->ac,c->a")
+        sage: graphs=[]
+        sage: for i in xrange(4):
+        ....:     G=MarkedGraph(GraphWithInverses.rose_graph(phi.domain().alphabet()))
+        ....:     G.precompose(phi**i)
+        ....:     graphs.append(G)
+        sage: M=Core.intersection_matrix(graphs)
+        sage: M.is_symmetric()
+        True
+        sage: M[0,2]==Core(graphs[0],graphs[2]).volume()
+        True
+        """
+        global _intersection_data
+
+        n=len(graphs)
+        inverses=[G.marking_inverse() for G in graphs]
+        pairs=[(i,j) for i in xrange(n) for j in xrange(i+1,n)]
+        result=matrix(n)
+
+        _intersection_data=(graphs,inverses)
+        pool=None
+        try:
+            if workers is not None and workers>1 and len(pairs)>1:
+                from multiprocessing import Pool
+                pool=Pool(workers)
+                chunksize=max(1,len(pairs)//(4*workers))
+                numbers=pool.imap_unordered(_intersection_number,pairs,chunksize)
+            else:
+                numbers=(_intersection_number(pair) for pair in pairs)
+            for k,(i,j,volume) in enumerate(numbers):
+                result[i,j]=volume
+                result[j,i]=volume
+                if verbose:
+                    print "Intersection numbers: %d/%d computed"%(k+1,len(pairs))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            _intersection_data=None
+
+        return result
     
+
+
+_intersection_data=None # (graphs,marking inverses) shared with the worker
+                        # processes of Core.intersection_matrix()
+
+def _intersection_number(pair):
+    """
+    The intersection number of the marked graphs ``i`` and ``j`` of
+    ``_intersection_data`` where ``pair=(i,j)``.
+
+    OUTPUT:
+
+    The triple ``(i,j,volume)``.
+
+    This is a module-level function so that it can be sent to the
+    worker processes of ``Core.intersection_matrix()``.
+    """
+    i,j=pair
+    graphs,inverses=_intersection_data
+    G=graphs[i]
+    H=graphs[j]
+    edge_map=(H.marking()*inverses[i]).tighten().edge_map()
+    inv_edge_map=(G.marking()*inverses[j]).edge_map()
+    return (i,j,Core(G,H,edge_map,inv_edge_map).volume())
+
+def _core_slice_edges(ends):
+    """
+    Vertices and edges of the slice of a core.
+
+    INPUT:
+
+    ``ends`` a tuple of (unsigned) ends, each given as a string.
+
+    OUTPUT:
+
+    A couple ``(vertices,edges)`` of tuples, in the order in which they
+    are added to the slice. Edges are triples
+    ``(initial_vertex,terminal_vertex,label)``.
+
+    This is a module-level function so that it can be sent to the
+    worker processes of ``Core._build_core()``.
+    """
+    if not ends:
+        return ((),())
+
+    # find common prefix
+    common=ends[0]
+    for e in ends:
+        common=common[:lcp(e,common)]
+    common_len=len(common)
+
+    vertices=[]
+    seen_vertices=set()
+    edges=[]
+    seen_edges=set()
+    for e in ends:
+        v_label=common
+        for a in e[common_len:-1]:
+            if v_label not in seen_vertices:
+                seen_vertices.add(v_label)
+                vertices.append(v_label)
+            t_label=v_label+a
+            if t_label not in seen_vertices:
+                seen_vertices.add(t_label)
+                vertices.append(t_label)
+            edge=(v_label,t_label,a)
+            if edge not in seen_edges:
+                seen_edges.add(edge)
+                edges.append(edge)
+            v_label=t_label
+    return (tuple(vertices),tuple(edges))
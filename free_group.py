@@ -15,9 +15,12 @@ from sage.categories.groups import Groups
 from sage.categories.infinite_enumerated_sets import InfiniteEnumeratedSets
 from sage.categories.finite_enumerated_sets import FiniteEnumeratedSets
 from sage.sets.finite_enumerated_set import FiniteEnumeratedSet
+import numpy
+import weakref
 
 from inverse_alphabet import build_alphabet_with_inverses
-from free_group_word import FreeGroupWord
+from free_group_word import FreeGroupWord, FrozenFreeGroupWord
+from packed_words import pack_words, unpack_words, reduce_packed
 class FreeGroup(UniqueRepresentation, Group):
     """
     Free group of finite rank.
@@ -64,6 +67,7 @@ class FreeGroup(UniqueRepresentation, Group):
         self._invert.update(zip(pos,neg))
         self._invert.update(zip(neg,pos))
         self._alphabet = build_alphabet(pos.list() + neg.list())
+        self._frozen_words = weakref.WeakValueDictionary()
         
     def gens(self):
         r"""
@@ -211,6 +215,74 @@ class FreeGroup(UniqueRepresentation, Group):
             data=[]
         return self.element_class(self, data, check)
 
+    def frozen_word(self, data):
+        r"""
+        The immutable element of ``self`` given by ``data``.
+
+        Frozen words are interned: as long as it is referenced, the
+        same ``FrozenFreeGroupWord`` is returned for equal elements, so
+        that repeated words share their storage.
+
+        EXAMPLES::
+
+            sage: F = FreeGroup('ab')
+            sage: u = F.frozen_word('abAa')
+            sage: u
+            ab
+            sage: u is F.frozen_word(F('ab'))
+            True
+        """
+        if isinstance(data, FreeGroupWord) and data.parent() is self:
+            key = tuple(data)
+        else:
+            key = tuple(self(data))
+        try:
+            return self._frozen_words[key]
+        except KeyError:
+            result = FrozenFreeGroupWord(self, key)
+            self._frozen_words[key] = result
+            return result
+
+    def reduce_many(self, words, offsets=None):
+        r"""
+        Freely reduce a batch of words.
+
+        INPUT:
+
+        - ``words`` - a list of words (lists of letters), or an integer
+          array of packed words if ``offsets`` is given (see
+          ``pack_words()``).
+
+        - ``offsets`` - the offsets of the packed words in ``words``.
+
+        OUTPUT:
+
+        A couple ``(reduced,lengths)`` where ``lengths`` is the array of
+        the lengths of the reduced words. ``reduced`` is the list of the
+        reduced words as elements of ``self`` or, if ``offsets`` is
+        given, the couple ``(data,offsets)`` of the packed reduced
+        words.
+
+        ALGORITHM:
+
+        All the words are reduced at once with cancellation passes on
+        the packed array, see ``reduce_packed()``.
+
+        EXAMPLES::
+
+            sage: F = FreeGroup('ab')
+            sage: F.reduce_many(['abBa','aA','bAab'])
+            ([aa, THE_EMPTY_WORD, bb], array([2, 0, 2]))
+        """
+        if offsets is None:
+            data,offsets = pack_words(words, self)
+            data,offsets = reduce_packed(data, offsets)
+            reduced = [self(w, check=False) for w in unpack_words(data, offsets, self)]
+        else:
+            data,offsets = reduce_packed(numpy.asarray(words,dtype=int), numpy.asarray(offsets,dtype=int))
+            reduced = (data,offsets)
+        return (reduced, numpy.diff(offsets))
+
     #TODO
     def identity_automorphism(self):
         """
@@ -5,6 +5,7 @@
 #                  http://www.gnu.org/licenses/ 
 #***************************************************************************** 
 from sage.combinat.words.morphism import WordMorphism
+from packed_words import image_table, evaluate_packed
 
 class FreeGroupAutomorphism(WordMorphism):
     """
@@ -71,6 +72,43 @@ class FreeGroupAutomorphism(WordMorphism):
             w=result    
         return result
         
+    def evaluate_many(self,data,offsets,order=1):
+        """
+        Apply ``self**order`` to the words packed in ``(data,offsets)``.
+
+        INPUT:
+
+        - ``data``, ``offsets``: integer arrays as given by
+          ``pack_words(words,F)`` where ``F`` is the domain of
+          ``self``.
+
+        - ``order``: (default 1) the number of times ``self`` is
+          applied.
+
+        OUTPUT:
+
+        The reduced images packed as ``(data,offsets)``.
+
+        EXAMPLES::
+
+        sage: phi=FreeGroupAutomorphism("a->ab,b->ac,c->a")
+        sage: F=phi.domain()
+        sage: data,offsets=phi.evaluate_many(*pack_words(["a","bC"],F))
+        sage: unpack_words(data,offsets,F)
+        [['a', 'b'], ['a', 'c', 'A']]
+        sage: data,offsets=phi.evaluate_many(*pack_words(["a","bC"],F),order=2)
+        sage: unpack_words(data,offsets,F)
+        [['a', 'b', 'a', 'c'], ['a', 'b', 'a', 'B', 'A']]
+
+        SEE ALSO:
+
+        The module ``packed_words`` which packs the words in NumPy
+        arrays and reduces them in batches.
+        """
+        F=self._domain
+        table=image_table(lambda a:list(self.image(a)),F,F)
+        return evaluate_packed(data,offsets,table,order)
+
     def __mul__(self, other):
         """
         Returns the composition self*other.
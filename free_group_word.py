@@ -6,6 +6,7 @@
 #***************************************************************************** 
 from sage.combinat.words.abstract_word import Word_class
 from sage.structure.element import MonoidElement
+from packed_words import lcp
 
 # right now it is not possible to inherit from both Element and FiniteWord_list
 # (they both defined an attribute Parent). But at least it is possible to
@@ -28,6 +29,12 @@ class FreeGroupWord(MonoidElement):
  
     - Thierry Coulbois (2013-05-16): initial version 
     """
+    # The words built by FreeGroup() are instances of its element
+    # class, which gets an instance dictionary from the category:
+    # these slots only save memory in FrozenFreeGroupWord, which is
+    # instantiated directly.
+    __slots__ = ('_data', '__weakref__')
+
     def __init__(self, parent, data, check=False):
         r"""
         INPUT:
@@ -48,7 +55,7 @@ class FreeGroupWord(MonoidElement):
         else:
             assert isinstance(data, list)
             self._data = data
-            
+
     def _check_alphabet(self):
         r"""
         Check the alphabet of ``self``.
@@ -114,7 +121,11 @@ class FreeGroupWord(MonoidElement):
         r"""
         Equality test.
         """
-        return isinstance(other, FreeGroupWord) and self.parent() is other.parent() and self._data == other._data
+        if not isinstance(other, FreeGroupWord) or self.parent() is not other.parent():
+            return False
+        if type(self._data) is type(other._data):
+            return self._data == other._data
+        return list(self._data) == list(other._data)
 
     def __ne__(self, other):
         r"""
@@ -125,7 +136,7 @@ class FreeGroupWord(MonoidElement):
     def __cmp__(self, other):
         if not isinstance(other, FreeGroupWord) or self.parent() is not other.parent():
             raise TypeError("can not compare words on different free groups")
-        return cmp(self._data, other._data)
+        return cmp(list(self), list(other))
 
     def __nonzero__(self):
         r"""
@@ -286,7 +297,7 @@ class FreeGroupWord(MonoidElement):
         f = self.parent().inverse_letter
         while i<len(self) and i<len(other) and f(self[-i-1]) == other[i]:
             i=i+1
-        return self.parent()(self._data[:len(self)-i]+other._data[i:], check=False)
+        return self.parent()(list(self._data[:len(self)-i])+list(other._data[i:]), check=False)
 
     def __invert__(self):
         """
@@ -319,10 +330,7 @@ class FreeGroupWord(MonoidElement):
             sage: u.common_prefix_length(v)
             2
         """
-        k=0
-        while k<len(u) and k<len(v) and u[k]==v[k]:
-            k=k+1
-        return k
+        return lcp(self._data, other._data)
 
     def is_prefix(self, other):
         """
@@ -343,12 +351,7 @@ class FreeGroupWord(MonoidElement):
             sage: u.is_prefix(u) and v.is_prefix(v) and w.is_prefix(w)
             True
         """
-        if len(other) < len(self):
-            return False
-        i = 0
-        while i < len(self) and self[i] == other[i]:
-            i += 1
-        return i == len(self)
+        return len(self) <= len(other) and lcp(self._data, other._data) == len(self)
 
     def has_prefix(self, other):
         r"""
@@ -369,12 +372,95 @@ class FreeGroupWord(MonoidElement):
             sage: u.has_prefix(u) and v.has_prefix(v) and w.has_prefix(w)
             True
         """
-        if len(self) < len(other):
-            return False
-        i = 0
-        while i < len(other) and self[i] == other[i]:
-            i += 1
-        return i == len(other)
+        return len(other) <= len(self) and lcp(self._data, other._data) == len(other)
+
+    def cyclic_reduce(self):
+        r"""
+        The cyclically reduced word conjugate to ``self``, obtained by
+        removing from ``self`` its longest prefix whose inverse is a
+        suffix of ``self``.
+
+        EXAMPLES::
+
+            sage: F = FreeGroup('abc')
+            sage: F('abcBA').cyclic_reduce()
+            c
+            sage: F('abc').cyclic_reduce()
+            abc
+        """
+        data = self._data
+        f = self.parent().inverse_letter
+        n = len(data)
+        k = 0
+        while 2*k+1 < n and f(data[k]) == data[n-k-1]:
+            k += 1
+        if k == 0:
+            return self
+        return self.parent()(list(data[k:n-k]), check=False)
+
+    def canonical_cyclic_form(self):
+        r"""
+        A hashable key of the conjugacy class of ``self``.
+
+        OUTPUT:
+
+        The least (for the lexicographic order on letters) cyclic
+        permutation of the cyclic reduction of ``self``, as a tuple of
+        letters.
+
+        Two words are conjugate if and only if they have the same
+        canonical cyclic form.
+
+        ALGORITHM:
+
+        Booth's least rotation algorithm, linear in the length of
+        ``self``.
+
+        EXAMPLES::
+
+            sage: F = FreeGroup('abc')
+            sage: F('cabaBC').canonical_cyclic_form()
+            ('B', 'a', 'b', 'a')
+            sage: F('aBab').canonical_cyclic_form()
+            ('B', 'a', 'b', 'a')
+        """
+        data = self.cyclic_reduce()._data
+        k = _least_rotation(data)
+        return tuple(data[k:] + data[:k])
+
+    def is_conjugate(self, other):
+        r"""
+        Test if ``self`` and ``other`` are conjugate.
+
+        EXAMPLES::
+
+            sage: F = FreeGroup('abc')
+            sage: F('abcBA').is_conjugate(F('c'))
+            True
+            sage: F('ab').is_conjugate(F('ba'))
+            True
+            sage: F('ab').is_conjugate(F('aB'))
+            False
+        """
+        return (self.parent() is other.parent() and
+                self.canonical_cyclic_form() == other.canonical_cyclic_form())
+
+    def freeze(self):
+        r"""
+        The immutable word equal to ``self``, shared with all the
+        frozen words with the same letters.
+
+        SEE ALSO:
+
+        ``FrozenFreeGroupWord``, ``FreeGroup.frozen_word()``
+
+        EXAMPLES::
+
+            sage: F = FreeGroup('abc')
+            sage: F('abc').freeze() is F('aBbbc').freeze()
+            True
+        """
+        return self.parent().frozen_word(self)
 
     #TODO: check with Thierry that it does what it should
     def nielsen_lesser_than(self,other):
@@ -418,3 +504,103 @@ class FreeGroupWord(MonoidElement):
                     if self[l-half:l] <= self[l-half:l]:
                         return -1
         return result
+
+
+def _least_rotation(s):
+    r"""
+    The index of the least rotation of the list ``s``.
+
+    ALGORITHM:
+
+    Booth's algorithm (a Knuth-Morris-Pratt failure function on
+    ``s+s``), linear in the length of ``s``.
+    """
+    s = s + s
+    f = [-1] * len(s)
+    k = 0
+    for j in xrange(1, len(s)):
+        c = s[j]
+        i = f[j-k-1]
+        while i != -1 and c != s[k+i+1]:
+            if c < s[k+i+1]:
+                k = j-i-1
+            i = f[i]
+        if c != s[k+i+1]:
+            # here i == -1
+            if c < s[k]:
+                k = j
+            f[j-k] = -1
+        else:
+            f[j-k] = i+1
+    return k
+
+
+class FrozenFreeGroupWord(FreeGroupWord):
+    r"""
+    Immutable element of a free group of finite rank.
+
+    The letters are stored in a tuple and the hash is computed once,
+    so that frozen words can be used as keys of dictionaries.  Frozen
+    words are usually built by ``FreeGroup.frozen_word()`` or
+    ``FreeGroupWord.freeze()`` which return a unique frozen word for
+    each element of the free group (as long as it is referenced).
+
+    Products, inverses and factors of frozen words are (not frozen)
+    ``FreeGroupWord``.
+
+    EXAMPLES::
+
+        sage: F = FreeGroup('abc')
+        sage: w = F.frozen_word('abcC')
+        sage: w
+        ab
+        sage: d = {w: 1}
+        sage: d[F('ab').freeze()]
+        1
+    """
+    __slots__ = ('_hash',)
+
+    def __init__(self, parent, data, check=False):
+        r"""
+        INPUT:
+
+        - ``parent`` - a free group
+
+        - ``data`` - the letters of the word
+
+        - ``check`` - wether to check the letters and reduce the word
+        """
+        FreeGroupWord.__init__(self, parent, list(data), check)
+        self._data = tuple(self._data)
+        self._hash = hash(self._data)
+
+    def __hash__(self):
+        r"""
+        The (cached) hash of ``self``.
+        """
+        return self._hash
+
+    def __eq__(self, other):
+        r"""
+        Equality test.
+        """
+        if self is other:
+            return True
+        if isinstance(other, FrozenFreeGroupWord):
+            if self._hash != other._hash or self.parent() is not other.parent():
+                return False
+            return self._data == other._data
+        return FreeGroupWord.__eq__(self, other)
+
+    def __ne__(self, other):
+        r"""
+        Difference test.
+        """
+        return not self.__eq__(other)
+
+    def freeze(self):
+        r"""
+        The frozen word ``self``.
+        """
+        return self
+
@@ -5,8 +5,11 @@
 #                  http://www.gnu.org/licenses/ 
 #***************************************************************************** 
 from sage.combinat.words.morphism import WordMorphism
+from collections import deque
+from itertools import izip
+from packed_words import image_table, evaluate_packed, pack_words, code_letters
 
-class GraphMap():
+class GraphMap(object):
     """
     A GraphMap is a map from a Graph to another .  It maps a vertex to
     a vertex and an edge to an edge-path. It respects incidence
@@ -17,6 +20,7 @@ class GraphMap():
     - Thierry Coulbois (2013-05-16): beta.0 version 
 	 
     """
+    __slots__=('_domain','_codomain','_edge_map','_vertex_map','_letter_images')
     
     def __init__(self,domain,codomain,edge_map,vertex_map=None):
         self._domain=domain
@@ -40,7 +44,7 @@ class GraphMap():
                 
             return self._vertex_map[argument]
         else:
-            return self._codomain.reduce_path(self._edge_map(argument))
+            return self.path_image(argument)
 
     def __mul__(self,other):
         """
@@ -98,6 +102,7 @@ class GraphMap():
             m[A.inverse_letter(a)]=self._codomain.reverse_path(m[a])
         self._edge_map=WordMorphism(m)
         self._vertex_map=None
+        self._letter_images=None
 
     def compose_edge_map(self,edge_morph):
         """
@@ -142,6 +147,222 @@ class GraphMap():
         """
         A homotopy inverse of ``self``. 
 
+        The inverse is computed by folding the domain subdivided
+        according to the images of its edges, see
+        ``_inverse_by_folding()``. If ``self`` has no such inverse
+        (for instance if the codomain has vertices of valence 1), the
+        inverse is computed through a ``FreeGroupAutomorphism``, see
+        ``_inverse_by_automorphism()``.
+
+        EXAMPLES::
+
+        sage: phi=FreeGroupAutomorphism("a->ab,b->ac,c->a")
+        sage: f=GraphMap.rose_map(phi)
+        sage: g=f.inverse()
+        sage: g.image('a'),g.image('b'),g.image('c')
+        (word: c, word: Ca, word: Cb)
+
+        WARNING:
+        
+        ``self`` is assumed to be a homotopy equivalence.
+        """
+        result=self._inverse_by_folding()
+        if result is None:
+            result=self._inverse_by_automorphism()
+        return result
+
+    def _inverse_by_folding(self):
+        """
+        A homotopy inverse of ``self`` computed with Stallings folds,
+        or ``None`` if the folded graph is not the codomain.
+
+        ALGORITHM:
+
+        Each edge ``e`` of the domain is subdivided according to its
+        image, edges with a trivial image are contracted. Each vertex
+        of this subdivided graph is anchored at a vertex of the
+        domain and each edge carries a path in the domain between the
+        anchors of its ends: the last piece of ``e`` carries ``e``
+        and the other pieces carry the trivial path.
+
+        Edges with the same image and the same origin are then folded.
+        When two vertices are identified, the paths of the edges
+        incident to the removed vertex are re-anchored. Vertices of
+        the domain are kept, so that the inverse of a map between
+        roses is exact.
+
+        If ``self`` is a homotopy equivalence, the folded graph is
+        usually isomorphic to the codomain and the paths carried by its
+        edges give the inverse.
+        """
+        G1=self.domain()
+        A1=G1.alphabet()
+        G2=self.codomain()
+        A2=G2.alphabet()
+
+        def reduce_letters(word):
+            result=[]
+            for x in word:
+                if len(result)>0 and A1.are_inverse(result[-1],x):
+                    result.pop()
+                else:
+                    result.append(x)
+            return result
+
+        def reverse_letters(word):
+            return [A1.inverse_letter(x) for x in reversed(word)]
+
+        # contract the edges with trivial image: root[v] is the vertex
+        # that represents v and path[v] a path from root[v] to v
+        contracted=dict()
+        for a in A1.positive_letters():
+            if len(self.image(a))==0:
+                u=G1.initial_vertex(a)
+                v=G1.terminal_vertex(a)
+                contracted.setdefault(u,[]).append(a)
+                contracted.setdefault(v,[]).append(A1.inverse_letter(a))
+
+        root=dict()
+        path=dict()
+        for v in G1.vertices():
+            if v in root: continue
+            root[v]=v
+            path[v]=[]
+            todo=[v]
+            used=set()
+            while len(todo)>0:
+                u=todo.pop()
+                for a in contracted.get(u,[]):
+                    if A1.to_positive_letter(a) in used: continue
+                    used.add(A1.to_positive_letter(a))
+                    w=G1.terminal_vertex(a)
+                    if w in root:
+                        return None # a loop with trivial image
+                    root[w]=v
+                    path[w]=path[u]+[a]
+                    todo.append(w)
+
+        # the subdivided graph: vertices are integers, edges are lists
+        # [initial vertex, terminal vertex, positive letter of A2, path in G1]
+        anchor=dict()
+        original=dict()
+        vertex=dict()
+        for v in G1.vertices():
+            if root[v]==v:
+                vertex[v]=len(anchor)
+                anchor[vertex[v]]=v
+                original[vertex[v]]=True
+
+        edges=dict()
+        star=dict((x,dict()) for x in anchor)
+        todo=[]
+
+        def attach(i):
+            x,y,b,p=edges[i]
+            bb=A2.inverse_letter(b)
+            for z,c in ((x,b),(y,bb)):
+                l=star[z].setdefault(c,[])
+                l.append(i)
+                if len(l)==2: todo.append((z,c))
+
+        for a in A1.positive_letters():
+            a_image=self.image(a)
+            if len(a_image)==0: continue
+            x=vertex[root[G1.initial_vertex(a)]]
+            y=vertex[root[G1.terminal_vertex(a)]]
+            last=reduce_letters(path[G1.initial_vertex(a)]+[a]+reverse_letters(path[G1.terminal_vertex(a)]))
+            for k in xrange(len(a_image)):
+                if k<len(a_image)-1:
+                    z=len(anchor)
+                    anchor[z]=anchor[x]
+                    original[z]=False
+                    star[z]=dict()
+                    p=[]
+                else:
+                    z=y
+                    p=last
+                b=a_image[k]
+                if A2.is_positive_letter(b):
+                    edges[len(edges)]=[x,z,b,p]
+                else:
+                    edges[len(edges)]=[z,x,A2.inverse_letter(b),reverse_letters(p)]
+                attach(len(edges)-1)
+                x=z
+
+        # folds
+        while len(todo)>0:
+            x,c=todo.pop()
+            if x not in star or len(star[x].get(c,[]))<2: continue
+            ends=[]
+            for i in star[x][c][:2]:
+                e=edges[i]
+                if e[0]==x and e[2]==c:
+                    ends.append((i,e[1],e[3]))
+                else:
+                    ends.append((i,e[0],reverse_letters(e[3])))
+            (i1,y1,p1),(i2,y2,p2)=ends
+            if original[y2] and not original[y1]:
+                (i1,y1,p1),(i2,y2,p2)=(i2,y2,p2),(i1,y1,p1)
+
+            # remove the edge i2 that goes to y2
+            e=edges.pop(i2)
+            star[e[0]][e[2]].remove(i2)
+            star[e[1]][A2.inverse_letter(e[2])].remove(i2)
+            if len(star[x][c])>1: todo.append((x,c))
+
+            delta=reduce_letters(reverse_letters(p1)+p2) # from anchor[y1] to anchor[y2]
+            if y1==y2:
+                if len(delta)>0:
+                    return None # self is not injective on the fundamental groups
+                continue
+
+            # identify y2 with y1
+            gone=star.pop(y2)
+            ids=set(i for l in gone.itervalues() for i in l)
+            for i in ids:
+                e=edges[i]
+                if e[0]==y2:
+                    e[0]=y1
+                    e[3]=delta+e[3]
+                if e[1]==y2:
+                    e[1]=y1
+                    e[3]=e[3]+reverse_letters(delta)
+                e[3]=reduce_letters(e[3])
+            for c,l in gone.iteritems():
+                if len(l)==0: continue
+                ll=star[y1].setdefault(c,[])
+                ll.extend(l)
+                if len(ll)>1: todo.append((y1,c))
+
+        # the folded graph should be the codomain
+        if len(edges)!=len(A2.positive_letters()) or len(star)!=len(G2.vertices()):
+            return None
+        edge_map=dict()
+        vertex_map=dict()
+        image_vertex=dict()
+        for x,y,b,p in edges.itervalues():
+            if b in edge_map: return None
+            edge_map[b]=Word(p)
+            for z,w in ((x,G2.initial_vertex(b)),(y,G2.terminal_vertex(b))):
+                if image_vertex.setdefault(z,w)!=w: return None
+                if vertex_map.setdefault(w,anchor[z])!=anchor[z]: return None
+        if len(image_vertex)!=len(star) or len(vertex_map)!=len(star):
+            return None
+
+        return GraphMap(G2,G1,edge_map,vertex_map)
+
+    def _inverse_by_automorphism(self):
+        """
+        A homotopy inverse of ``self`` computed with the inverse of a
+        ``FreeGroupAutomorphism``.
+
+        ALGORITHM:
+
+        Spanning trees of the domain and of the codomain give bases of
+        their fundamental groups. ``self`` is translated into an
+        automorphism which is inverted with the Nielsen-Whitehead
+        algorithm, and the inverse is translated back.
+
         WARNING:
         
         ``self`` is assumed to be a homotopy equivalence.
@@ -205,6 +426,137 @@ class GraphMap():
         return GraphMap(G2,G1,edge_map)
 
         
+    def path_image(self,path,prefix_length=None):
+        """
+        The reduced image of the edge path ``path``.
+
+        If ``prefix_length`` is given, only the prefix of length
+        ``prefix_length`` of the reduced image is computed.
+
+        The images of the edges are pushed letter by letter on a
+        cancellation stack. When only a prefix is required, the
+        evaluation stops as soon as the remaining images cannot
+        cancel the first ``prefix_length`` letters of the stack.
+
+        EXAMPLES::
+
+        sage: phi=FreeGroupAutomorphism("a->ab,b->ac,c->a")
+        sage: f=GraphMap.rose_map(phi)
+        sage: f.path_image("Cb")
+        word: c
+        sage: f.path_image("abcabc",2)
+        word: ab
+        """
+        images,inverse=self._images()
+        stack=[]
+        if prefix_length is None:
+            for a in path:
+                for b in images[a]:
+                    if len(stack)>0 and stack[-1]==inverse[b]:
+                        stack.pop()
+                    else:
+                        stack.append(b)
+        else:
+            remaining=sum(len(images[a]) for a in path)
+            for a in path:
+                for b in images[a]:
+                    if len(stack)>0 and stack[-1]==inverse[b]:
+                        stack.pop()
+                    else:
+                        stack.append(b)
+                remaining-=len(images[a])
+                if len(stack)-remaining>=prefix_length:
+                    break
+            del stack[prefix_length:]
+        return Word(stack)
+
+    def path_images(self,paths,prefix_length=None):
+        """
+        The list of the reduced images of the edge paths of
+        ``paths``.
+
+        If ``prefix_length`` is given, only the prefixes of length
+        ``prefix_length`` of the reduced images are returned.
+
+        ALGORITHM:
+
+        The paths are packed in a single array and evaluated together
+        by ``evaluate_many()``: the images of the edges are gathered
+        and reduced for all the paths at once.
+
+        EXAMPLES::
+
+        sage: phi=FreeGroupAutomorphism("a->ab,b->ac,c->a")
+        sage: f=GraphMap.rose_map(phi)
+        sage: f.path_images(["Cb","abc"])
+        [word: c, word: abaca]
+        sage: f.path_images(["Cb","abc"],2)
+        [word: c, word: ab]
+
+        SEE ALSO:
+
+        ``GraphMap.path_image()``
+        """
+        data,offsets=self.evaluate_many(*pack_words(paths,self._domain.alphabet()))
+        letters=code_letters(self._codomain.alphabet())
+        data=data.tolist()
+        offsets=offsets.tolist()
+        if prefix_length is None:
+            ends=offsets[1:]
+        else:
+            ends=[min(offsets[i]+prefix_length,offsets[i+1]) for i in xrange(len(paths))]
+        return [Word([letters[c] for c in data[offsets[i]:ends[i]]]) for i in xrange(len(paths))]
+
+    def evaluate_many(self,data,offsets,order=1):
+        """
+        Apply ``self`` (``order`` times) to the paths packed in
+        ``(data,offsets)``.
+
+        INPUT:
+
+        - ``data``, ``offsets``: integer arrays as given by
+          ``pack_words(paths,G.alphabet())`` where ``G`` is the
+          domain of ``self``.
+
+        - ``order``: (default 1) the number of times ``self`` is
+          applied. If ``order>1``, the domain and the codomain of
+          ``self`` must be the same graph.
+
+        OUTPUT:
+
+        The reduced images packed as ``(data,offsets)`` over the
+        alphabet of the codomain.
+
+        SEE ALSO:
+
+        ``FreeGroupAutomorphism.evaluate_many()``
+        """
+        if order>1 and self._domain is not self._codomain:
+            raise ValueError, "the domain and the codomain must be the same graph"
+        images,inverse=self._images()
+        table=image_table(images.__getitem__,self._domain.alphabet(),self._codomain.alphabet())
+        return evaluate_packed(data,offsets,table,order)
+
+    def _images(self):
+        """
+        The images of the letters as tuples, together with a
+        dictionary of the inverses of the letters that appear in
+        these images.
+
+        Computed once and cached until the next call to
+        ``set_edge_map()``.
+        """
+        if self._letter_images is None:
+            A=self._codomain.alphabet()
+            images=dict((a,tuple(self._edge_map.image(a))) for a in self._domain.alphabet())
+            inverse=dict()
+            for u in images.itervalues():
+                for b in u:
+                    if b not in inverse:
+                        inverse[b]=A.inverse_letter(b)
+            self._letter_images=(images,inverse)
+        return self._letter_images
+
     def tighten(self):
         """
         Tighten ``self`` such that there are at least two gates at
@@ -217,41 +569,64 @@ class GraphMap():
 
         ``self`` and ``self.tighten()`` are homotopic.
 
+        ALGORITHM:
+
+        Keeps a worklist of the vertices of the domain. The common
+        prefix of the images of the edges outgoing from a vertex is
+        removed, and the terminal vertices of these edges are put
+        back in the worklist.
+
         """
         G1=self.domain()
         A1=G1.alphabet()
-        G2=self.domain()
-
-        edge_map=dict((a,self.image(a)) for a in A1)
-
-        done=False
-        while not done:
-            done=True
-            prefix=dict()
-            for a in A1:
-                u=edge_map[a]
-                v=G1.initial_vertex(a)
+        A2=self.codomain().alphabet()
+
+        # images as deques: prefixes and suffixes are trimmed in place
+        images=dict((a,deque(self.image(a))) for a in A1)
+        outgoing=dict((v,[]) for v in G1.vertices())
+        for a in A1:
+            outgoing[G1.initial_vertex(a)].append(a)
+
+        todo=deque(outgoing)
+        in_todo=set(todo)
+        while len(todo)>0:
+            v=todo.popleft()
+            in_todo.discard(v)
+
+            prefix=None
+            for a in outgoing[v]:
+                u=images[a]
                 if len(u)>0:
-                    if v in prefix:
-                        if len(prefix[v])>0:
-                            p=G2.common_prefix_length(u,prefix[v])
-                            prefix[v]=prefix[v][:p]
+                    if prefix is None:
+                        prefix=list(u)
                     else:
-                        prefix[v]=u
-
-            for a in A1: 
-                v=G1.initial_vertex(a)
-                if v in prefix and len(prefix[v])>0:
-                    done=False
-                    aa=A1.inverse_letter(a)
-                    if len(edge_map[a])>0:
-                        edge_map[a]=edge_map[a][len(prefix[v]):]
-                        edge_map[aa]=edge_map[aa][:-len(prefix[v])]
-                    else:    
-                        edge_map[a]=G2.reverse_path(prefix[v])
-                        edge_map[aa]=prefix[v]
-
-        self.set_edge_map(edge_map)
+                        p=0
+                        for x,y in izip(prefix,u):
+                            if x!=y: break
+                            p+=1
+                        del prefix[p:]
+                    if len(prefix)==0: break
+            if prefix is None or len(prefix)==0:
+                continue
+
+            for a in outgoing[v]:
+                aa=A1.inverse_letter(a)
+                if len(images[a])>0:
+                    for i in xrange(len(prefix)):
+                        images[a].popleft()
+                        images[aa].pop()
+                else:
+                    images[a]=deque(A2.inverse_letter(x) for x in reversed(prefix))
+                    images[aa]=deque(prefix)
+                w=G1.terminal_vertex(a)
+                if w not in in_todo:
+                    todo.append(w)
+                    in_todo.add(w)
+            if v not in in_todo:
+                todo.append(v)
+                in_todo.add(v)
+
+        self.set_edge_map(dict((a,Word(list(images[a]))) for a in A1.positive_letters()))
 
         return self
 
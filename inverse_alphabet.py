@@ -59,3 +59,396 @@ def build_alphabet_with_inverses(data, neg=None, names=None, name=None, negname=
 
     return pos, neg
 
+
+
+class AlphabetWithInverses(object):
+    r"""
+    A finite alphabet with an involution without fixed points.
+
+    The letters are partitioned into positive letters and their
+    inverses (negative letters).
+
+    INPUT:
+
+    - ``alphabet`` - an integer ``n`` (the alphabet has ``n`` positive
+      letters), a list of positive letters or another
+      ``AlphabetWithInverses``.
+
+    - ``inverse`` - (optional) the list of the inverses of the letters
+      of ``alphabet``. By default the inverse of a letter is obtained
+      by swapping its case.
+
+    - ``type`` - the names of the letters when ``alphabet`` is an
+      integer or when new letters are added: ``'abc'`` (default, the
+      letters ``a, b, c,...`` with inverses ``A, B, C,...``), ``'a0'``
+      (``a0, a1,...`` with inverses ``A0, A1,...``) or ``'x0'``
+      (``x0, x1,...`` with inverses ``X0, X1,...``).
+
+    Each positive letter has an integer code ``i>0`` which does not
+    change while the letter is in the alphabet, its inverse has code
+    ``-i``. The inverse, the positive letter, the sign, the rank and
+    the order of each letter are stored in dictionaries so that all
+    the queries are done in constant time.
+
+    The letters are ordered as they were added: a new letter comes
+    after all the letters of the alphabet. The codes and names of
+    removed letters are reused by ``add_new_letter()`` (this does not
+    change the order), and ``compact()`` renames the letters so that
+    they are the first letters of their type.
+
+    EXAMPLES::
+
+        sage: A=AlphabetWithInverses(3)
+        sage: A
+        Alphabet with inverses on ['a', 'b', 'c']
+        sage: A.inverse_letter('b')
+        'B'
+        sage: A.add_new_letter()
+        ['d', 'D']
+        sage: A.remove_letter('B')
+        sage: A.positive_letters()
+        ('a', 'c', 'd')
+        sage: A.rank('D')
+        2
+        sage: AlphabetWithInverses(2,type='x0')
+        Alphabet with inverses on ['x0', 'x1']
+        sage: A.add_new_letter()
+        ['b', 'B']
+        sage: A.positive_letters()
+        ('a', 'c', 'd', 'b')
+        sage: A.remove_letter('a')
+        sage: sorted(A.compact().items())
+        [('B', 'C'), ('C', 'A'), ('D', 'B'), ('b', 'c'), ('c', 'a'), ('d', 'b')]
+        sage: A
+        Alphabet with inverses on ['a', 'b', 'c']
+    """
+
+    def __init__(self,alphabet=None,inverse=None,type='abc'):
+        self._type=type
+        self._positive=[] # positive letter of each code (None if removed)
+        self._negative=[] # negative letter of each code (None if removed)
+        self._code={}     # letter -> code (+-(index+1) in _positive)
+        self._inverse={}
+        self._to_positive={}
+        self._order={}    # letter -> key for less_letter()
+        self._next_order=0 # key of the next letter added
+        self._next_name=0 # index of the next name tried for a new letter
+        self._free=[] # (code,letter,inverse) of removed letters
+        self._letters=[] # positive letters in order
+        self._positive_letters=None # cached tuple of positive letters
+        self._negative_letters=None # cached tuple of negative letters
+        self._rank={} # letter -> rank, exact for the ranks < _ranked
+        self._ranked=0
+
+        if alphabet is None:
+            alphabet=[]
+        if isinstance(alphabet,(int,Integer)):
+            self.add_new_letters(alphabet)
+        elif isinstance(alphabet,AlphabetWithInverses):
+            for a in alphabet.positive_letters():
+                self._add_letter(a,alphabet.inverse_letter(a))
+        elif inverse is None:
+            for a in alphabet:
+                if a not in self._code:
+                    self._add_letter(a,a.swapcase())
+        else:
+            for a,aa in zip(alphabet,inverse):
+                self._add_letter(a,aa)
+
+    def _add_letter(self,a,aa,i=None):
+        r"""
+        Add the letter ``a`` with inverse ``aa``, with code ``i+1``.
+
+        ``i`` is a free index in ``self._positive``, by default a new
+        index is created.
+
+        For internal use only.
+        """
+        if a in self._code or aa in self._code or a==aa:
+            raise ValueError("can not add the letters %s and %s"%(a,aa))
+        if i is None:
+            i=len(self._positive)
+            self._positive.append(a)
+            self._negative.append(aa)
+        else:
+            self._positive[i]=a
+            self._negative[i]=aa
+        self._code[a]=i+1
+        self._code[aa]=-i-1
+        self._inverse[a]=aa
+        self._inverse[aa]=a
+        self._to_positive[a]=a
+        self._to_positive[aa]=a
+        self._order[a]=self._next_order
+        self._order[aa]=self._next_order+_NEGATIVE_ORDER
+        self._next_order+=1
+        if self._ranked==len(self._letters):
+            self._rank[a]=self._ranked
+            self._rank[aa]=self._ranked
+            self._ranked+=1
+        self._letters.append(a)
+        self._positive_letters=None
+        self._negative_letters=None
+
+    def _name(self,i):
+        r"""
+        The ``i``-th couple ``(letter,inverse)`` of names of the type
+        of ``self``.
+
+        For internal use only.
+        """
+        if self._type=='abc':
+            if i<26:
+                a=chr(97+i)
+            else:
+                a='a%d'%i
+            return (a,a.upper())
+        elif self._type=='x0':
+            return ('x%d'%i,'X%d'%i)
+        return ('a%d'%i,'A%d'%i)
+
+    def _new_name(self):
+        r"""
+        A couple ``(letter,inverse)`` of names not in ``self``.
+
+        For internal use only.
+        """
+        while True:
+            a,aa=self._name(self._next_name)
+            self._next_name+=1
+            if a not in self._code and aa not in self._code:
+                return (a,aa)
+
+    def __repr__(self):
+        r"""
+        String representation of ``self``.
+        """
+        return "Alphabet with inverses on %s"%list(self.positive_letters())
+
+    def __iter__(self):
+        r"""
+        Iterator over the positive letters and then the negative
+        letters of ``self``.
+        """
+        for a in self.positive_letters():
+            yield a
+        for a in self.negative_letters():
+            yield a
+
+    def __len__(self):
+        r"""
+        The number of positive letters of ``self``.
+        """
+        return len(self.positive_letters())
+
+    def cardinality(self):
+        r"""
+        The number of positive letters of ``self``.
+        """
+        return len(self.positive_letters())
+
+    def __contains__(self,a):
+        r"""
+        ``True`` if ``a`` is a letter of ``self``.
+        """
+        return a in self._code
+
+    def __getitem__(self,i):
+        r"""
+        The ``i``-th letter of ``self``: positive letters come first,
+        then the negative letters, in the same order.
+        """
+        positive=self.positive_letters()
+        if i<len(positive):
+            return positive[i]
+        return self.negative_letters()[i-len(positive)]
+
+    def positive_letters(self):
+        r"""
+        The tuple of the positive letters of ``self``.
+        """
+        if self._positive_letters is None:
+            self._positive_letters=tuple(self._letters)
+        return self._positive_letters
+
+    def negative_letters(self):
+        r"""
+        The tuple of the negative letters of ``self``, in the order of
+        the positive letters.
+        """
+        if self._negative_letters is None:
+            inverse=self._inverse
+            self._negative_letters=tuple(inverse[a] for a in self._letters)
+        return self._negative_letters
+
+    def inverse_letter(self,a):
+        r"""
+        The inverse of the letter ``a``.
+        """
+        return self._inverse[a]
+
+    def to_positive_letter(self,a):
+        r"""
+        The positive letter of ``a`` and its inverse.
+        """
+        return self._to_positive[a]
+
+    def is_positive_letter(self,a):
+        r"""
+        ``True`` if ``a`` is a positive letter.
+        """
+        return self._code[a]>0
+
+    def are_inverse(self,a,b):
+        r"""
+        ``True`` if ``a`` and ``b`` are inverse letters.
+        """
+        return self._inverse[a]==b
+
+    def less_letter(self,a,b):
+        r"""
+        ``True`` if ``a`` is before ``b`` in ``self``: positive letters
+        come before negative letters, and letters of the same sign are
+        ordered as their positive letters.
+        """
+        return self._order[a]<self._order[b]
+
+    def rank(self,a):
+        r"""
+        The index of the positive letter of ``a`` in
+        ``positive_letters()``.
+
+        Removing a letter only invalidates the ranks of the letters
+        after it, they are updated at the next call.
+        """
+        r=self._rank.get(a)
+        if r is None or r>=self._ranked:
+            self._update_ranks()
+            r=self._rank[a]
+        return r
+
+    def _update_ranks(self):
+        r"""
+        Update the ranks of the letters after the first removed
+        letter.
+
+        For internal use only.
+        """
+        rank=self._rank
+        inverse=self._inverse
+        letters=self._letters
+        for i in xrange(self._ranked,len(letters)):
+            b=letters[i]
+            rank[b]=i
+            rank[inverse[b]]=i
+        self._ranked=len(letters)
+
+    def code(self,a):
+        r"""
+        The integer code of the letter ``a``: positive for positive
+        letters, the opposite for their inverses.
+
+        The code of a letter does not change while it is in ``self``.
+        """
+        return self._code[a]
+
+    def random_letter(self,exclude=[]):
+        r"""
+        A random letter of ``self`` not in ``exclude``.
+        """
+        from random import choice
+        return choice([a for a in self if a not in exclude])
+
+    def add_new_letter(self):
+        r"""
+        Add a new letter and its inverse to ``self``.
+
+        The code and the names of the last removed letter are reused
+        when possible. The new letter comes after all the letters of
+        ``self``.
+
+        OUTPUT:
+
+        The list ``[letter,inverse]``.
+        """
+        if self._free:
+            i,a,aa=self._free.pop()
+            if a in self._code or aa in self._code:
+                a,aa=self._new_name()
+            self._add_letter(a,aa,i)
+        else:
+            a,aa=self._new_name()
+            self._add_letter(a,aa)
+        return [a,aa]
+
+    def add_new_letters(self,n):
+        r"""
+        Add ``n`` new letters and their inverses to ``self``.
+
+        OUTPUT:
+
+        The list of the lists ``[letter,inverse]``.
+        """
+        return [self.add_new_letter() for i in xrange(n)]
+
+    def remove_letter(self,a):
+        r"""
+        Remove the letter ``a`` and its inverse from ``self``.
+        """
+        i=abs(self._code[a])-1
+        b=self._positive[i]
+        r=self._rank.get(b)
+        if r is None or r>=self._ranked:
+            r=self._letters.index(b)
+        del self._letters[r]
+        self._rank.pop(b,None)
+        self._rank.pop(self._negative[i],None)
+        self._ranked=min(self._ranked,r)
+        self._free.append((i,b,self._negative[i]))
+        for b in (self._positive[i],self._negative[i]):
+            del self._code[b]
+            del self._inverse[b]
+            del self._to_positive[b]
+            del self._order[b]
+        self._positive[i]=None
+        self._negative[i]=None
+        self._positive_letters=None
+        self._negative_letters=None
+
+    def holes(self):
+        r"""
+        The number of codes of removed letters that are not reused yet.
+        """
+        return len(self._free)
+
+    def compact(self):
+        r"""
+        Rename the letters of ``self`` to the first names of the type
+        of ``self``, keeping their order, and forget the removed
+        letters.
+
+        OUTPUT:
+
+        A dictionary that maps each old letter to its new name.
+        """
+        letters=[(a,self._inverse[a]) for a in self.positive_letters()]
+        self.__init__(type=self._type)
+        renaming=dict()
+        for i,(a,aa) in enumerate(letters):
+            b,bb=self._name(i)
+            self._add_letter(b,bb)
+            renaming[a]=b
+            renaming[aa]=bb
+        self._next_name=len(letters)
+        return renaming
+
+    def copy(self):
+        r"""
+        A copy of ``self``.
+        """
+        result=AlphabetWithInverses(self,type=self._type)
+        result._next_name=self._next_name
+        return result
+
+
+_NEGATIVE_ORDER=1<<40 # negative letters come after all positive letters
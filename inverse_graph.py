@@ -4,6 +4,8 @@
 #  Distributed under the terms of the GNU General Public License (GPL) 
 #                  http://www.gnu.org/licenses/ 
 #***************************************************************************** 
+from packed_words import lcp
+
 class GraphWithInverses(sage.graphs.graph.DiGraph):
      """
      A GraphWithInverses is a simplicial oriented graph, with labeled
@@ -37,6 +39,7 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
 
           self._initial={}
           self._terminal={}
+          self._spanning_trees={} # root -> (parent edges, root paths), see _tree_parents()
 
           letters=[]
           if isinstance(data,dict):
@@ -139,6 +142,7 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
                DiGraph.add_edge(self,ww,v,pe)
           self._initial[e]=v
           self._terminal[self._alphabet.inverse_letter(e)]=v
+          self._spanning_trees.clear()
           
 
      def terminal_vertex(self,edge_label):
@@ -168,6 +172,7 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
                
           self._terminal[e]=v
           self._initial[self._alphabet.inverse_letter(e)]=v
+          self._spanning_trees.clear()
 
      def reverse_path(self,path):
           """
@@ -217,7 +222,8 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
                inv_label=self.alphabet().inverse_letter(label)
                self._initial[inv_label]=v
                self._terminal[inv_label]=u
-                
+
+          self._spanning_trees.clear()
           return label
 
      def new_vertex(self):
@@ -259,6 +265,7 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
           if i==None:
                i=self.new_vertex()
           DiGraph.add_vertex(self,i)
+          self._spanning_trees.clear()
           return i
 
      def remove_edge(self,e):
@@ -274,6 +281,7 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
           self._initial.pop(ee)
           self._terminal.pop(e)
           self._terminal.pop(ee)
+          self._spanning_trees.clear()
 
      def remove_vertex(self,v):
           """
@@ -285,6 +293,35 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
 
           """
           DiGraph.delete_vertex(self,v)
+          self._spanning_trees.clear()
+
+     def rename_edges(self,renaming):
+          """
+          Renames the edges of ``self``.
+
+          INPUT:
+
+          ``renaming`` is a dictionnary that maps each edge label
+          (positive or negative) to its new label. Positive letters
+          are mapped to positive letters.
+
+          WARNING:
+
+          Does not change the alphabet of ``self`` (the new labels are
+          assumed to be already in the alphabet).
+
+          SEE ALSO:
+
+          ``AlphabetWithInverses.compact()``
+          """
+          initial=dict((renaming[a],v) for a,v in self._initial.iteritems())
+          terminal=dict((renaming[a],v) for a,v in self._terminal.iteritems())
+          edges=self.edges()
+          DiGraph.delete_edges(self,edges)
+          DiGraph.add_edges(self,[(u,v,renaming[a]) for (u,v,a) in edges])
+          self._initial=initial
+          self._terminal=terminal
+          self._spanning_trees.clear()
 
      def reduce_path(self,path):
           """
@@ -319,9 +356,7 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
         sage: rose_graph(AlphabetWithInverses(3)).common_prefix_length("aBaa","aBcb")
         2
         """
-        k=0
-        while(k<len(p) and k<len(q) and p[k]==q[k]): k=k+1
-        return k
+        return lcp(p,q)
 
      def is_prefix(self,p,q):
           """
@@ -333,16 +368,7 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
          
           """
 
-          i=0
-          l=len(p)
-          if l<=len(q):
-               done=False
-               while i<l and not done:
-                    done= not p[i]==q[i]
-                    i=i+1
-               return not done
-          else:
-               return False
+          return len(p)<=len(q) and lcp(p,q)==len(p)
           
 
 
@@ -424,7 +450,16 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
         vertex. a is less than b in the ``self.alphabet()`` order.
         """
         A=self._alphabet
-        return [(a,b) for a in A for b in A if a!=b and A.less_letter(a,b) and self.initial_vertex(a)==self.initial_vertex(b)]
+        outgoing=dict()
+        for a in A:
+            v=self.initial_vertex(a)
+            if v in outgoing: outgoing[v].append(a)
+            else: outgoing[v]=[a]
+        result=[]
+        for a in A:
+            for b in outgoing[self.initial_vertex(a)]:
+                if A.less_letter(a,b): result.append((a,b))
+        return result
 
 
      def extensions(self,u,turns):
@@ -676,7 +711,73 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
                          
           return lines
 
-     def maximal_tree(self):
+     def _tree_parents(self,root=None):
+          """
+          A breadth-first spanning tree of the connected component of
+          ``root`` (by default the initial vertex of the first letter
+          of the alphabet).
+
+          OUTPUT:
+
+          A tuple ``(root,parent,order,paths)`` where ``parent`` maps
+          each vertex ``v`` of the tree to the edge of the tree that
+          ends at ``v`` (``None`` for the root), ``order`` is the list
+          of vertices in breadth-first order and ``paths`` is a
+          dictionary of the paths from the root already computed by
+          ``tree_path()``.
+
+          The tree is cached and the cache is cleared by any change
+          of the edges or vertices of ``self``.
+          """
+          A=self._alphabet
+          if root is None:
+               root=self.initial_vertex(A[0])
+          if root in self._spanning_trees:
+               return self._spanning_trees[root]
+
+          outgoing=dict()
+          for a in A.positive_letters():
+               outgoing.setdefault(self.initial_vertex(a),[]).append(a)
+               outgoing.setdefault(self.terminal_vertex(a),[]).append(A.inverse_letter(a))
+
+          parent={root:None}
+          order=[root]
+          i=0
+          while i<len(order):
+               for a in outgoing.get(order[i],[]):
+                    v=self.terminal_vertex(a)
+                    if v not in parent:
+                         parent[v]=a
+                         order.append(v)
+               i+=1
+
+          tree=(root,parent,order,{root:Word()})
+          self._spanning_trees[root]=tree
+          return tree
+
+     def tree_path(self,v,root=None):
+          """
+          The path from ``root`` (by default the root of
+          ``spanning_tree()``) to ``v`` in the spanning tree rooted at
+          ``root``.
+
+          Paths are computed only when needed and cached together with
+          the spanning tree.
+          """
+          root,parent,order,paths=self._tree_parents(root)
+          branch=[]
+          u=v
+          while u not in paths:
+               branch.append(parent[u])
+               u=self.initial_vertex(parent[u])
+          path=paths[u]
+          while len(branch)>0:
+               a=branch.pop()
+               path=path*Word([a])
+               paths[self.terminal_vertex(a)]=path
+          return paths[v]
+
+     def maximal_tree(self,root=None):
           """
           A maximal tree for ``self``. 
 
@@ -687,64 +788,40 @@ class GraphWithInverses(sage.graphs.graph.DiGraph):
           WARNING: 
 
           If ``self`` is not connected, returns a maximal tree of the
-          connected component of the first edge labeled by the first
-          letter of the alphabet.
+          connected component of ``root`` (by default the initial
+          vertex of the first letter of the alphabet).
 
           SEE ALSO:
 
           GraphWithInverses.spanning_tree()
           """
 
-          tree=[]
+          root,parent,order,paths=self._tree_parents(root)
           A=self._alphabet
-          tree_vertices=[self.initial_vertex(A[0])]
-          done=False
-          while not done:
-               done=True
-               for a in A.positive_letters():
-                    if self.initial_vertex(a) in tree_vertices and self.terminal_vertex(a) not in tree_vertices:
-                         tree.append(a)
-                         tree_vertices.append(self.terminal_vertex(a))
-                         done=False
-                    elif self.terminal_vertex(a) in tree_vertices and self.initial_vertex(a) not in tree_vertices:
-                         tree.append(a)
-                         tree_vertices.append(self.initial_vertex(a))
-                         done=False
-          return tree
+          return [A.to_positive_letter(parent[v]) for v in order[1:]]
 
-     def spanning_tree(self):
+     def spanning_tree(self,root=None):
           """
           A spanning tree.
 
           OUPUT:
           
-          a dictionnary that maps each vertex to an edge-path from the origin vertex.
+          a dictionnary that maps each vertex to an edge-path from the
+          origin vertex ``root`` (by default the initial vertex of the
+          first letter of the alphabet).
 
           SEE ALSO:
           
           ``maximal_tree()`` that returns a list of edges of a spanning tree.
+          ``tree_path()`` that returns only one of these paths.
 
           WARNING:
 
           ``self`` must be connected.
           """
 
-          A=self._alphabet
-          tree={self.initial_vertex(A[0]):Word()}
-
-          done=False
-          while not done:
-               done=True
-               for a in A.positive_letters():
-                    vi=self.initial_vertex(a)
-                    vt=self.terminal_vertex(a)
-                    if vi in tree and vt not in tree:
-                         tree[vt]=self.reduce_path(tree[vi]*Word([a]))
-                         done=False
-                    elif vt in tree and vi not in tree:
-                         tree[vi]=self.reduce_path(tree[vt]*Word([A.inverse_letter(a)]))
-                         done=False
-          return tree
+          root,parent,order,paths=self._tree_parents(root)
+          return dict((v,self.tree_path(v,root)) for v in order)
 
           
 
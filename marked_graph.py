@@ -39,15 +39,12 @@ class MarkedGraph(GraphWithInverses):
               if marking is None: #computes a (random) marking from a rose equivalent to graph
 
                    A=graph.alphabet()
-                   tree=graph.spanning_tree()
+                   tree=set(graph.maximal_tree())
 
                    j=0
                    letter=dict()
                    for a in A.positive_letters():
-                        vi=graph.initial_vertex(a)
-                        vt=graph.terminal_vertex(a)
-                        if (len(tree[vi])==0 or tree[vi][-1]!=A.inverse_letter(a)) and\
-                                 (len(tree[vt])==0 or tree[vt][-1]!=a):
+                        if a not in tree:
                              letter[j]=a
                              j=j+1
 
@@ -60,9 +57,9 @@ class MarkedGraph(GraphWithInverses):
 
                    for i in xrange(j):
                         a=letter[i]
-                        edge_map[B[i]]=graph.reduce_path(tree[graph.initial_vertex(a)]\
+                        edge_map[B[i]]=graph.reduce_path(graph.tree_path(graph.initial_vertex(a))\
                                                            *Word([a])\
-                                                           *graph.reverse_path(tree[graph.terminal_vertex(a)]))
+                                                           *graph.reverse_path(graph.tree_path(graph.terminal_vertex(a))))
 
                         marking=GraphMap(RB,graph,edge_map)
               else:
@@ -90,6 +87,21 @@ class MarkedGraph(GraphWithInverses):
           """
           return self._marking
 
+     def marking_inverse(self):
+          """
+          A ``GraphMap`` from ``self`` to the rose, homotopy inverse
+          of the marking.
+
+          The inverse is computed once and cached: it is recomputed
+          only when the edge map of the marking has been changed.
+          """
+          edge_map=self._marking._edge_map
+          cache=getattr(self,'_marking_inverse',None)
+          if cache is None or cache[0] is not edge_map:
+               cache=(edge_map,self._marking.inverse())
+               self._marking_inverse=cache
+          return cache[1]
+
      def precompose(self,automorphism):
           """
           Precompose the marking by ``automorphism``.
@@ -101,12 +113,28 @@ class MarkedGraph(GraphWithInverses):
           return self
           
 
+     def rename_edges(self,renaming):
+          """
+          Renames the edges of ``self`` and accordingly the image of
+          the marking.
+
+          SEE ALSO:
+
+          ``GraphWithInverses.rename_edges()``
+          """
+          GraphWithInverses.rename_edges(self,renaming)
+          edge_map=dict()
+          for a in self._marking.domain().alphabet().positive_letters():
+               edge_map[a]=Word([renaming[b] for b in self._marking.image(a)])
+          self._marking.set_edge_map(edge_map)
+          return self
+
      def difference_of_marking(self,other):
           """
           A ``GraphMap`` from ``self`` to ``other`` that makes the markings commute.
           """
 
-          return other.marking()*self.marking().inverse()
+          return other.marking()*self.marking_inverse()
 
 
      def subdivide(self,edge_list):
@@ -223,8 +251,26 @@ class MarkedMetricGraph(MarkedGraph):
           """
           Sets the length of the edge ``a`` to ``l``.
           """
-          length[a]=l
-          length[self.alphabet().inverse_letter(a)]=l
+          self._length[a]=l
+          self._length[self.alphabet().inverse_letter(a)]=l
+
+     def length_vector(self,letters=None):
+          """
+          The NumPy vector of the lengths of the edges labeled by
+          ``letters`` (by default the positive letters of the
+          alphabet).
+
+          EXAMPLES::
+
+          sage: G=MarkedMetricGraph.splitting(1,AlphabetWithInverses(2))
+          sage: G.length_vector()
+          array([ 0.,  0.,  1.])
+          """
+          import numpy
+
+          if letters is None:
+               letters=self.alphabet().positive_letters()
+          return numpy.array([self._length[a] for a in letters],dtype=float)
 
 
 
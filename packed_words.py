@@ -0,0 +1,625 @@
+#*****************************************************************************
+#       Copyright (C) 2013 Thierry Coulbois <thierry.coulbois@univ-amu.fr>
+#
+#  Distributed under the terms of the GNU General Public License (GPL)
+#                  http://www.gnu.org/licenses/
+#*****************************************************************************
+import numpy
+from itertools import izip
+
+
+def letter_codes(A):
+    """
+    The dictionary that maps the letters of ``A`` to their codes.
+    """
+    codes=dict()
+    for j,a in enumerate(A.positive_letters()):
+        codes[a]=j+1
+        codes[A.inverse_letter(a)]=-j-1
+    return codes
+
+
+def code_letters(A):
+    """
+    The dictionary that maps the codes to the letters of ``A``.
+    """
+    return dict((c,a) for a,c in letter_codes(A).iteritems())
+
+
+def pack_words(words,A):
+    """
+    Packs the list of ``words`` over the alphabet ``A``.
+
+    OUTPUT:
+
+    A couple ``(data,offsets)`` of integer arrays: the word ``i`` is
+    ``data[offsets[i]:offsets[i+1]]``. The positive letter ``A[j]``
+    is coded by ``j+1`` and its inverse by ``-(j+1)``, so that two
+    letters are inverse if and only if their codes sum up to 0.
+
+    EXAMPLES::
+
+    sage: A=AlphabetWithInverses(3)
+    sage: data,offsets=pack_words(["ab","","cAab"],A)
+    sage: data
+    array([ 1,  2,  3, -1,  1,  2])
+    sage: offsets
+    array([0, 2, 2, 6])
+    sage: data,offsets=reduce_packed(data,offsets)
+    sage: unpack_words(data,offsets,A)
+    [['a', 'b'], [], ['c', 'b']]
+    """
+    codes=letter_codes(A)
+    lengths=[len(w) for w in words]
+    offsets=numpy.zeros(len(lengths)+1,dtype=int)
+    numpy.cumsum(lengths,out=offsets[1:])
+    data=numpy.fromiter((codes[a] for w in words for a in w),dtype=int,count=offsets[-1])
+    return (data,offsets)
+
+
+def unpack_words(data,offsets,A):
+    """
+    The list of words (as lists of letters of ``A``) packed in
+    ``(data,offsets)``.
+    """
+    letters=code_letters(A)
+    data=data.tolist()
+    offsets=offsets.tolist()
+    return [[letters[c] for c in data[offsets[i]:offsets[i+1]]] for i in xrange(len(offsets)-1)]
+
+
+def image_table(image,A,B):
+    """
+    The packed images of the letters of ``A``, indexed by their codes.
+
+    INPUT:
+
+    - ``image``: a function that maps a letter of ``A`` to a word over
+      ``B``.
+
+    - ``A``, ``B``: the alphabets of the domain and of the codomain.
+
+    OUTPUT:
+
+    A couple ``(data,offsets)``: the image of the letter of code ``c``
+    is the packed word of index ``c+len(A)``. The word of index
+    ``len(A)`` (code 0) is empty.
+    """
+    n=len(A.positive_letters())
+    letters=code_letters(A)
+    words=[image(letters[c]) if c!=0 else [] for c in xrange(-n,n+1)]
+    return pack_words(words,B)
+
+
+def apply_morphism(data,offsets,table):
+    """
+    Applies the morphism given by the ``table`` of images (see
+    ``image_table()``) to the words packed in ``(data,offsets)``.
+
+    The result is not reduced.
+
+    ALGORITHM:
+
+    The images are gathered from the table with a single indexing
+    operation.
+    """
+    table_data,table_offsets=table
+    n=(len(table_offsets)-2)//2
+    index=data+n
+    starts=table_offsets[index]
+    lengths=table_offsets[index+1]-starts
+
+    # image offsets of each letter and of each word
+    letter_offsets=numpy.zeros(len(data)+1,dtype=int)
+    numpy.cumsum(lengths,out=letter_offsets[1:])
+    new_offsets=letter_offsets[offsets]
+
+    total=letter_offsets[-1]
+    gather=numpy.repeat(starts-letter_offsets[:-1],lengths)+numpy.arange(total)
+    return (table_data[gather],new_offsets)
+
+
+def reduce_packed(data,offsets,max_passes=8):
+    """
+    Freely reduces the words packed in ``(data,offsets)``.
+
+    ALGORITHM:
+
+    Each pass works on all the words at once. In each run of
+    consecutive cancelling pairs (an alternating chain like ``aAaA``)
+    every other pair is chosen. Each chosen pair is then extended on
+    both sides as long as the letters cancel (like ``bcCB``) and do
+    not belong to another extended pair. All the extended pairs are
+    removed at once. After ``max_passes`` passes, the words that are
+    not yet reduced are reduced one by one with a cancellation stack.
+    """
+    n=len(offsets)-1
+    word=numpy.repeat(numpy.arange(n),numpy.diff(offsets))
+
+    for i in xrange(max_passes):
+        if len(data)<2: break
+        cancel=(data[:-1]+data[1:]==0)&(word[:-1]==word[1:])
+        if not cancel.any(): break
+
+        # in a run of consecutive cancelling pairs choose every other pair
+        starts=cancel.copy()
+        starts[1:]&=~cancel[:-1]
+        run=numpy.cumsum(starts)-1
+        run_start=numpy.flatnonzero(starts)
+        position=numpy.arange(len(cancel))-run_start[numpy.maximum(run,0)]
+        left=numpy.flatnonzero(cancel&(position%2==0))
+        right=left+1
+        taken=numpy.zeros(len(data),dtype=bool)
+        taken[left]=True
+        taken[right]=True
+
+        # extend the chosen pairs
+        while len(left)>0:
+            active=(left>0)&(right<len(data)-1)
+            left=left[active]-1
+            right=right[active]+1
+            active=(data[left]+data[right]==0)&(word[left]==word[right])&~taken[left]&~taken[right]
+            left=left[active]
+            right=right[active]
+            # a letter between two pairs cannot be used by both
+            active=~numpy.in1d(left,right)
+            left=left[active]
+            right=right[active]
+            taken[left]=True
+            taken[right]=True
+
+        data=data[~taken]
+        word=word[~taken]
+    else:
+        if len(data)>=2:
+            cancel=(data[:-1]+data[1:]==0)&(word[:-1]==word[1:])
+            if cancel.any():
+                return _reduce_packed_stack(data,word,n,numpy.unique(word[:-1][cancel]))
+
+    new_offsets=numpy.zeros(n+1,dtype=int)
+    numpy.cumsum(numpy.bincount(word,minlength=n),out=new_offsets[1:])
+    return (data,new_offsets)
+
+
+def _reduce_packed_stack(data,word,n,unreduced):
+    """
+    Reduces with a cancellation stack the words of indices
+    ``unreduced`` of the letters ``data`` where ``word`` gives the
+    index of the word of each letter.
+    """
+    offsets=numpy.zeros(n+1,dtype=int)
+    numpy.cumsum(numpy.bincount(word,minlength=n),out=offsets[1:])
+    pieces=[]
+    lengths=numpy.diff(offsets)
+    last=0
+    for i in unreduced:
+        pieces.append(data[offsets[last]:offsets[i]])
+        stack=[]
+        for c in data[offsets[i]:offsets[i+1]].tolist():
+            if len(stack)>0 and stack[-1]==-c:
+                stack.pop()
+            else:
+                stack.append(c)
+        pieces.append(numpy.array(stack,dtype=int))
+        lengths[i]=len(stack)
+        last=i+1
+    pieces.append(data[offsets[last]:])
+    new_offsets=numpy.zeros(n+1,dtype=int)
+    numpy.cumsum(lengths,out=new_offsets[1:])
+    return (numpy.concatenate(pieces),new_offsets)
+
+
+def cancellation_table(table):
+    """
+    The number of letters that cancel between two images of the
+    ``table`` (see ``image_table()``).
+
+    OUTPUT:
+
+    An integer array ``C`` where ``C[i,j]`` is the length of the
+    longest common prefix of the inverse of the word of index ``i``
+    of ``table`` and of the word of index ``j``.
+    """
+    table_data,table_offsets=table
+    m=len(table_offsets)-1
+    words=[table_data[table_offsets[i]:table_offsets[i+1]] for i in xrange(m)]
+    result=numpy.zeros((m,m),dtype=int)
+    for i in xrange(m):
+        if len(words[i])==0: continue
+        inverse=-words[i][::-1]
+        for j in xrange(m):
+            if len(words[j])>0 and words[j][0]==inverse[0]:
+                result[i,j]=lcp(inverse,words[j])
+    return result
+
+
+def apply_reduced(data,offsets,table,cancellation):
+    """
+    Applies the morphism given by the ``table`` of reduced images
+    (see ``image_table()``) to the reduced words packed in
+    ``(data,offsets)`` and reduces the result.
+
+    ALGORITHM:
+
+    Each letter of the words is replaced by a piece ``[start,end)``
+    of the buffer of the table. As the words and the images are
+    reduced, letters only cancel where two pieces meet. In each round
+    the cancellations at all the junctions are computed at once (by
+    ``cancellation`` for the first round, see
+    ``cancellation_table()``), cut down so that the two junctions of
+    a piece do not overlap, and the pieces are shortened accordingly.
+    Empty pieces are removed and only the junctions that changed are
+    checked again. The pieces are gathered with a single indexing
+    operation at the end.
+    """
+    table_data,table_offsets=table
+    n=(len(table_offsets)-2)//2
+    m=len(offsets)-1
+    index=data+n
+    start=table_offsets[index]
+    end=table_offsets[index+1]
+    word=numpy.repeat(numpy.arange(m),numpy.diff(offsets))
+    keep=end>start
+    if not keep.all():
+        index,start,end,word=index[keep],start[keep],end[keep],word[keep]
+
+    junction=cancellation[index[:-1],index[1:]]
+    junction[word[:-1]!=word[1:]]=0
+    while junction.any():
+        # the cancellations at both ends of a piece must not overlap
+        length=end-start
+        cut=junction.copy()
+        cut[1:]=numpy.minimum(junction[1:],length[1:-1]-junction[:-1])
+        end[:-1]-=cut
+        start[1:]+=cut
+
+        # the junctions to check again
+        changed=numpy.zeros(len(start),dtype=bool)
+        changed[:-1]|=cut<junction
+        changed[1:]|=cut<junction
+        keep=end>start
+        removed=numpy.flatnonzero(~keep)
+        changed[removed[removed>0]-1]=True
+        changed[removed[removed<len(start)-1]+1]=True
+        start,end,word,changed=start[keep],end[keep],word[keep],changed[keep]
+
+        active=numpy.flatnonzero((changed[:-1]|changed[1:])&(word[:-1]==word[1:]))
+        junction=numpy.zeros(max(len(start)-1,0),dtype=int)
+        bound=numpy.minimum(end[active]-start[active],end[active+1]-start[active+1])
+        k=0
+        while len(active)>0:
+            match=table_data[end[active]-1-k]==-table_data[start[active+1]+k]
+            active=active[match]
+            bound=bound[match]
+            junction[active]+=1
+            k+=1
+            more=bound>k
+            active=active[more]
+            bound=bound[more]
+
+    lengths=end-start
+    new_offsets=numpy.zeros(m+1,dtype=int)
+    numpy.cumsum(numpy.bincount(word,weights=lengths,minlength=m).astype(int),out=new_offsets[1:])
+    if len(start)==0:
+        return (table_data[:0],new_offsets)
+
+    # the positions in table_data of the letters of the result: they
+    # increase by 1 inside a piece and jump from a piece to the next
+    gather=numpy.ones(new_offsets[-1],dtype=int)
+    gather[0]=start[0]
+    gather[numpy.cumsum(lengths[:-1])]=start[1:]-end[:-1]+1
+    return (table_data[numpy.cumsum(gather)],new_offsets)
+
+
+def evaluate_packed(data,offsets,table,order=1):
+    """
+    Applies ``order`` times the morphism given by ``table`` (see
+    ``image_table()``) to the words packed in ``(data,offsets)`` and
+    freely reduces the result.
+
+    The words and the images are reduced first, then each application
+    only cuts the images where they meet (see ``apply_reduced()``).
+    """
+    data,offsets=reduce_packed(numpy.asarray(data,dtype=int),numpy.asarray(offsets,dtype=int))
+    table=reduce_packed(*table)
+    cancellation=cancellation_table(table)
+    for i in xrange(order):
+        data,offsets=apply_reduced(data,offsets,table,cancellation)
+    return (data,offsets)
+
+
+def lcp(p,q):
+    """
+    Length of the longest common prefix of the words ``p`` and ``q``.
+
+    Two lists, tuples, strings or NumPy arrays are compared in chunks
+    of increasing sizes, other words (like Sage ``Word``) letter by
+    letter until the first difference.
+
+    EXAMPLES::
+
+    sage: lcp("aBaa","aBcb")
+    2
+    sage: lcp(range(1000),range(500)+[0])
+    500
+    """
+    n=min(len(p),len(q))
+    if isinstance(p,numpy.ndarray) and isinstance(q,numpy.ndarray):
+        k=0
+        c=64
+        while k<n:
+            c=min(c,n-k)
+            mismatch=numpy.flatnonzero(p[k:k+c]!=q[k:k+c])
+            if len(mismatch)>0:
+                return k+int(mismatch[0])
+            k+=c
+            c*=2
+        return n
+    elif type(p) is type(q) and isinstance(p,_SLICEABLE):
+        k=0
+        c=8
+        while k<n:
+            c=min(c,n-k)
+            if p[k:k+c]!=q[k:k+c]:
+                break
+            k+=c
+            c*=2
+        else:
+            return n
+        # the first difference is in [k,k+c)
+        while c>8:
+            h=c//2
+            if p[k:k+h]==q[k:k+h]:
+                k+=h
+                c-=h
+            else:
+                c=h
+        while p[k]==q[k]:
+            k+=1
+        return k
+    else:
+        k=0
+        for x,y in izip(p,q):
+            if x!=y: break
+            k+=1
+        return k
+
+_SLICEABLE=(list,tuple,str,unicode)
+
+
+def lcp_many(reference,data,offsets):
+    """
+    The lengths of the longest common prefixes of ``reference`` and
+    each of the words packed in ``(data,offsets)``.
+
+    INPUT:
+
+    - ``reference``: an integer array (a packed word).
+
+    - ``data``, ``offsets``: packed words (see ``pack_words()``).
+
+    OUTPUT:
+
+    An integer array.
+
+    EXAMPLES::
+
+    sage: A=AlphabetWithInverses(3)
+    sage: data,offsets=pack_words(["abc","aB","","abcab"],A)
+    sage: reference,_=pack_words(["abca"],A)
+    sage: lcp_many(reference,data,offsets)
+    array([3, 1, 0, 4])
+    """
+    reference=numpy.asarray(reference,dtype=int)
+    data=numpy.asarray(data,dtype=int)
+    offsets=numpy.asarray(offsets,dtype=int)
+    lengths=numpy.minimum(numpy.diff(offsets),len(reference))
+    n=len(lengths)
+
+    # positions (in the words and in data) of the letters to compare
+    word=numpy.repeat(numpy.arange(n),lengths)
+    starts=numpy.zeros(n+1,dtype=int)
+    numpy.cumsum(lengths,out=starts[1:])
+    position=numpy.arange(starts[-1])-starts[word]
+    mismatch=data[offsets[word]+position]!=reference[position]
+
+    # the first mismatch of each word, if any
+    result=lengths.copy()
+    first=numpy.flatnonzero(mismatch)
+    if len(first)>0:
+        first_word=word[first]
+        keep=numpy.ones(len(first),dtype=bool)
+        keep[1:]=first_word[1:]!=first_word[:-1]
+        result[first_word[keep]]=position[first[keep]]
+    return result
+
+
+class PrefixHashes(object):
+    """
+    Polynomial rolling hashes of the prefixes of a word, modulo the
+    prime ``2**61-1``.
+
+    Two factors of words with the same base have equal hashes if they
+    are equal, and different hashes with high probability if they are
+    different. Longest common prefixes of very long words are then
+    computed by a binary search on the hashes.
+
+    INPUT:
+
+    - ``word``: a word (any sequence of hashable letters).
+
+    - ``base``: (optional) the base of the polynomial hash. Hashes can
+      only be compared for the same base.
+
+    EXAMPLES::
+
+    sage: u=PrefixHashes("ab"*1000+"a")
+    sage: v=PrefixHashes("ab"*1000+"b",base=u.base)
+    sage: u.lcp(v)
+    2000
+    """
+
+    MODULUS=(1<<61)-1
+
+    def __init__(self,word,base=None):
+        if base is None:
+            import random
+            base=random.randrange(1<<20,self.MODULUS-1)
+        self.base=base
+        M=self.MODULUS
+        letters=dict()
+        prefix=[0]
+        power=[1]
+        h=0
+        p=1
+        for x in word:
+            if x not in letters:
+                letters[x]=hash(x)%M
+            h=(h*base+letters[x])%M
+            p=(p*base)%M
+            prefix.append(h)
+            power.append(p)
+        self._prefix=prefix
+        self._power=power
+
+    def __len__(self):
+        return len(self._prefix)-1
+
+    def hash(self,i,j):
+        """
+        The hash of the factor ``word[i:j]``.
+        """
+        M=self.MODULUS
+        return (self._prefix[j]-self._prefix[i]*self._power[j-i])%M
+
+    def lcp(self,other,i=0,j=0):
+        """
+        Length of the longest common prefix (with high probability)
+        of ``word[i:]`` and of ``other.word[j:]`` where ``other`` is a
+        ``PrefixHashes`` with the same base.
+
+        ALGORITHM:
+
+        Binary search on the length, ``O(log(n))`` comparisons of hashes.
+        """
+        if other.base!=self.base:
+            raise ValueError("the hashes must have the same base")
+        lo=0
+        hi=min(len(self)-i,len(other)-j)
+        while lo<hi:
+            mid=(lo+hi+1)//2
+            if self.hash(i,i+mid)==other.hash(j,j+mid):
+                lo=mid
+            else:
+                hi=mid-1
+        return lo
+
+
+class PackedEdgeMap(object):
+    """
+    The images of the positive letters of an alphabet by a morphism,
+    packed in a single integer buffer.
+
+    The image of the ``i``-th positive letter of ``A`` is coded (see
+    ``pack_words()``) in ``data[offsets[i]:offsets[i+1]]``. Images of
+    inverse letters are not stored: they are the reversed negated
+    images of the positive letters.
+
+    It is built on the fly, to compute counts and supports with
+    array operations, and is not kept: the edge map it is built from
+    remains the only storage of the images.
+
+    INPUT:
+
+    - ``image``: a function that maps a letter of ``A`` to a word over
+      ``A``.
+
+    - ``A``: an ``AlphabetWithInverses``.
+
+    EXAMPLES::
+
+    sage: A=AlphabetWithInverses(3)
+    sage: phi=WordMorphism("a->ab,b->ac,c->a")
+    sage: packed=PackedEdgeMap(phi.image,A)
+    sage: packed.counts()
+    array([[1, 1, 1],
+           [1, 0, 0],
+           [0, 1, 0]])
+    sage: packed.inverse_image_codes(1)
+    array([-3, -1])
+    sage: packed.image('B')
+    ['C', 'A']
+    """
+
+    def __init__(self,image,A,data=None,offsets=None):
+        self._alphabet=A
+        self._letters=A.positive_letters()
+        if data is None:
+            data,offsets=pack_words([image(a) for a in self._letters],A)
+        self.data=data
+        self.offsets=offsets
+
+    def __len__(self):
+        return len(self._letters)
+
+    def lengths(self):
+        """
+        The array of the lengths of the images of the positive letters.
+        """
+        return numpy.diff(self.offsets)
+
+    def image_codes(self,i):
+        """
+        The codes of the image of the ``i``-th positive letter (a view
+        on the buffer).
+        """
+        return self.data[self.offsets[i]:self.offsets[i+1]]
+
+    def inverse_image_codes(self,i):
+        """
+        The codes of the image of the inverse of the ``i``-th positive
+        letter.
+        """
+        return -self.data[self.offsets[i]:self.offsets[i+1]][::-1]
+
+    def image(self,a):
+        """
+        The image of the letter ``a`` as a list of letters.
+        """
+        A=self._alphabet
+        i=A.rank(a)
+        if A.is_positive_letter(a):
+            codes=self.image_codes(i)
+        else:
+            codes=self.inverse_image_codes(i)
+        letters=self._letters
+        return [letters[c-1] if c>0 else A.inverse_letter(letters[-c-1]) for c in codes.tolist()]
+
+    def counts(self,indices=None):
+        """
+        The matrix (as an integer array) of the number of occurrences
+        of the letter ``i`` or its inverse in the image of the letter
+        ``j``.
+
+        If ``indices`` is not ``None`` only the rows and columns of
+        the letters of these indices are kept, in this order.
+
+        ALGORITHM:
+
+        One ``numpy.bincount`` on the buffer.
+        """
+        m=len(self._letters)
+        columns=numpy.repeat(numpy.arange(m),self.lengths())
+        rows=numpy.abs(self.data)-1
+        counts=numpy.bincount(rows*m+columns,minlength=m*m).reshape(m,m)
+        if indices is not None:
+            counts=counts[numpy.ix_(indices,indices)]
+        return counts
+
+    def support(self,i):
+        """
+        The set of the positive letters that occur (or whose inverse
+        occurs) in the image of the ``i``-th positive letter.
+        """
+        letters=self._letters
+        return set(letters[c-1] for c in numpy.unique(numpy.abs(self.image_codes(i))).tolist())
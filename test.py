@@ -45,6 +45,421 @@ def test_stat(rangs,longueurs,puissance):
             print "rang: ",n,"longueur: ",l," time: ",cputime(t)/puissance," train-tracks: %.1f"%(stat/puissance*100)
 
 
+def test_evaluate_many(rang,longueur,nombre,order=1):
+    """
+    Compares ``evaluate_many()`` with ``__call__`` in a loop on
+    ``nombre`` random words of length ``longueur``, for a random
+    automorphism of the free group of rank ``rang`` and for its rose
+    representative.
+
+    Raises an ``AssertionError`` if the images differ, and prints the
+    times and the speed-up of ``evaluate_many()``.
+    """
+    F=FreeGroup(rang)
+    phi=F.random_automorphism(longueur)
+    f=phi.rose_representative()
+    words=[F.subset(longueur).random_element() for i in xrange(nombre)]
+    data,offsets=pack_words(words,F)
+
+    t=cputime()
+    images=[list(phi(w,order)) for w in words]
+    t_call=cputime(t)
+    t=cputime()
+    result=unpack_words(*phi.evaluate_many(data,offsets,order),A=F)
+    t_many=cputime(t)
+    assert result==images, "evaluate_many() differs from __call__ for %s"%phi
+    print "automorphism: ",t_call," ",t_many," speed-up: %.1f"%(t_call/t_many)
+
+    t=cputime()
+    images=[]
+    for w in words:
+        for i in xrange(order):
+            w=f(w)
+        images.append(list(w))
+    t_call=cputime(t)
+    t=cputime()
+    result=unpack_words(*f.evaluate_many(data,offsets,order),A=f.domain().alphabet())
+    t_many=cputime(t)
+    assert result==images, "evaluate_many() differs from __call__ for %s"%f
+    print "rose representative: ",t_call," ",t_many," speed-up: %.1f"%(t_call/t_many)
+
+
+def fold_illegal_turn(f):
+    """
+    Folds the first illegal turn of the topological representative
+    ``f``: two edges with the same initial vertex whose images start
+    with the same edge are folded along their common prefix.
+
+    OUTPUT:
+
+    The couple ``(turn,fold_morph)`` or ``None`` if ``f`` has no
+    illegal turn.
+    """
+    G=f.domain()
+    A=G.alphabet()
+    for a in A:
+        for b in A:
+            if a!=b and G.initial_vertex(a)==G.initial_vertex(b) and f.image(a)[0]==f.image(b)[0]:
+                u=f.image(a)
+                return ((a,b),f.fold((a,b),u[:G.common_prefix_length(u,f.image(b))]))
+    return None
+
+
+def test_fold(rang,longueur,nombre,folds=10):
+    """
+    Folds up to ``folds`` illegal turns of the rose representatives
+    of ``nombre`` random automorphisms of length ``longueur`` of the
+    free group of rank ``rang``.
+
+    Raises an ``AssertionError`` if a fold ``p`` from ``f`` to ``g``
+    does not satisfy ``g(p(e))=p(f(e))`` for an edge ``e``.
+    """
+    F=FreeGroup(rang)
+    for i in xrange(nombre):
+        phi=F.random_automorphism(longueur)
+        f=phi.rose_representative()
+        G=f.domain()
+        A=G.alphabet()
+        for k in xrange(folds):
+            old_images=dict((e,f.image(e)) for e in A)
+            fold=fold_illegal_turn(f)
+            if fold is None: break
+            turn,fold_morph=fold
+            for e,w in old_images.iteritems():
+                assert G.reduce_path(f(fold_morph.image(e)))==G.reduce_path(fold_morph(w)), "Fold of %s in the rose representative of %s"%(turn,phi)
+    print "rang: ",rang,"longueur: ",longueur," folds checked"
+
+
+def test_turn_index(rang,longueur,nombre,folds=10):
+    """
+    Folds up to ``folds`` illegal turns of the rose representatives
+    of ``nombre`` random automorphisms of length ``longueur`` of the
+    free group of rank ``rang``.
+
+    Raises an ``AssertionError`` if the turn index updated after each
+    fold differs from the index built from scratch.
+    """
+    F=FreeGroup(rang)
+    for i in xrange(nombre):
+        phi=F.random_automorphism(longueur)
+        f=phi.rose_representative()
+        A=f.domain().alphabet()
+        for k in xrange(folds):
+            index=TurnIndex()
+            index.update(f.edge_map(),f._images()[0],A)
+            occurrences=dict((t,index.occurrences(t)) for t in index.turns())
+            assert occurrences==dict((t,f.turn_index().occurrences(t)) for t in f.turn_index().turns()), "Turn index of %s"%f
+            if fold_illegal_turn(f) is None: break
+    print "rang: ",rang,"longueur: ",longueur," turn indices checked"
+
+
+def test_relative_folding(rang,longueur,nombre):
+    """
+    Compares ``find_relative_folding()`` with a naive search of the
+    turns in the images of the edges that are eventually folded, for
+    the rose representatives of ``nombre`` random automorphisms of
+    length ``longueur`` of the free group of rank ``rang``, seen as a
+    single stratum.
+    """
+    F=FreeGroup(rang)
+    for i in xrange(nombre):
+        phi=F.random_automorphism(longueur)
+        f=phi.rose_representative()
+        A=f.domain().alphabet()
+        f._strata=[set(A.positive_letters())]
+        turns=set()
+        for a in A.positive_letters():
+            w=f.image(a)
+            for j in xrange(1,len(w)):
+                turns.add((A.inverse_letter(w[j-1]),w[j]))
+        illegal=False
+        new=list(turns)
+        while not illegal and len(new)>0:
+            images=[f.image_turn(t) for t in new]
+            illegal=any(t[0]==t[1] for t in images)
+            new=[t for t in images if t not in turns and (t[1],t[0]) not in turns]
+            turns.update(new)
+        result=f.find_relative_folding(0)
+        assert illegal==(len(result)>0), "find_relative_folding() for %s"%phi
+        if illegal:
+            [e,j]=result[0]
+            w=f.image(e)
+            assert set(result[1])==set([A.inverse_letter(w[j-1]),w[j]])
+            for k in xrange(1,len(result)-1):
+                assert set(f.image_turn(result[k]))==set(result[k+1])
+            t=f.image_turn(result[-1])
+            assert t[0]==t[1]
+    print "rang: ",rang,"longueur: ",longueur," relative foldings checked"
+
+
+def test_linked_path(rang,longueur,nombre,folds=10):
+    """
+    Folds up to ``folds`` illegal turns of the rose representatives
+    of ``nombre`` random automorphisms of length ``longueur`` of the
+    free group of rank ``rang``, and rewrites the image of the edges
+    (stored as a ``_LinkedPath``) after each fold, as
+    ``fold_paths()`` does.
+
+    Raises an ``AssertionError`` if the rewritten path is not the
+    reduced image of the path by the fold.
+    """
+    F=FreeGroup(rang)
+    for i in xrange(nombre):
+        phi=F.random_automorphism(longueur)
+        f=phi.rose_representative()
+        G=f.domain()
+        A=G.alphabet()
+        p=G.reduce_path(f(Word([a for a in A.positive_letters()])))
+        path=_LinkedPath(p,A)
+        for k in xrange(folds):
+            fold=fold_illegal_turn(f)
+            if fold is None: break
+            turn,fold_morph=fold
+            p=G.reduce_path(fold_morph(p))
+            path.rewrite(fold_morph)
+            assert path.letters()==list(p), "Fold of %s in the rose representative of %s"%(turn,phi)
+            assert len(path)==len(p)
+    print "rang: ",rang,"longueur: ",longueur," paths checked"
+
+
+def test_loop_maps(rang,longueur,nombre):
+    """
+    Checks that the maps computed by ``_loop_maps()`` for the
+    train-track representatives of ``nombre`` random automorphisms of
+    length ``longueur`` of the free group of rank ``rang`` are
+    inverse to each other.
+    """
+    F=FreeGroup(rang)
+    for i in xrange(nombre):
+        phi=F.random_automorphism(longueur)
+        f=phi.train_track()
+        tree_edges,loops,rootpath,psi,psi_inv=f._loop_maps()
+        for b in loops:
+            assert psi_inv(psi(Word([b])))==Word([b]), "Loop maps of %s"%f
+            assert psi(psi_inv(Word([b])))==Word([b]), "Loop maps of %s"%f
+    print "rang: ",rang,"longueur: ",longueur," loop maps checked"
+
+
+def test_alphabet(rang,nombre):
+    """
+    Adds and removes ``nombre`` random letters to an alphabet with
+    inverses of rank ``rang``.
+
+    Raises an ``AssertionError`` if the codes, ranks, orders and
+    inverses of the letters do not agree with their definitions, or
+    if the positive letters are not in the order they were added.
+    """
+    from random import randint
+    A=AlphabetWithInverses(rang)
+    codes=dict((a,A.code(a)) for a in A)
+    order=list(A.positive_letters())
+    for i in xrange(nombre):
+        if len(A)>1 and randint(0,1)==0:
+            a=A.random_letter()
+            order.remove(A.to_positive_letter(a))
+            A.remove_letter(a)
+            codes=dict((b,c) for b,c in codes.iteritems() if b in A)
+        else:
+            a,aa=A.add_new_letter()
+            order.append(a)
+            codes[a]=A.code(a)
+            codes[aa]=A.code(aa)
+        positive=A.positive_letters()
+        assert list(positive)==order, "positive letters of %s"%A
+        assert list(A)==list(positive)+[A.inverse_letter(a) for a in positive]
+        for a in A:
+            aa=A.inverse_letter(a)
+            assert A.code(a)==codes[a] and A.code(aa)==-A.code(a)
+            assert A.inverse_letter(aa)==a and A.are_inverse(a,aa)
+            assert A.is_positive_letter(a)==(a in positive)
+            assert A.to_positive_letter(a)==(a if a in positive else aa)
+            assert A.rank(a)==positive.index(A.to_positive_letter(a))
+            for b in A:
+                assert A.less_letter(a,b)==((not A.is_positive_letter(a),A.rank(a))<(not A.is_positive_letter(b),A.rank(b)))
+    print "rang: ",rang," letters checked"
+
+
+def test_compact_alphabet(rang,longueur,nombre):
+    """
+    Compacts the alphabets of the train-track representatives of
+    ``nombre`` random automorphisms of length ``longueur`` of the
+    free group of rank ``rang``.
+
+    Raises an ``AssertionError`` if the renamed graph, marking and
+    edge map differ from the old ones up to the renaming.
+    """
+    F=FreeGroup(rang)
+    for i in xrange(nombre):
+        phi=F.random_automorphism(longueur)
+        f=phi.train_track()
+        G=f.domain()
+        A=G.alphabet()
+        old=dict((a,(G.initial_vertex(a),G.terminal_vertex(a),f.image(a))) for a in A)
+        marking=G.marking()
+        old_marking=dict((a,marking.image(a)) for a in marking.domain().alphabet())
+        renaming=f.compact_alphabet()
+        assert A.holes()==0 and len(A)==len(old)/2
+        for a,(vi,vt,w) in old.iteritems():
+            b=renaming.image(a)[0]
+            assert G.initial_vertex(b)==vi and G.terminal_vertex(b)==vt
+            assert f.image(b)==renaming(w), "Compact alphabet of %s"%f
+        marking=G.marking()
+        for a,w in old_marking.iteritems():
+            assert marking.image(a)==renaming(w), "Compact alphabet of %s"%f
+    print "rang: ",rang,"longueur: ",longueur," renamings checked"
+
+
+def test_reduce_many(rang,longueur,nombre):
+    """
+    Compares ``reduce_many()`` with the reduction of each word by
+    ``FreeGroup.__call__`` on ``nombre`` random (not reduced) words of
+    length at most ``longueur`` in the free group of rank ``rang``,
+    given as lists and as packed words.
+    """
+    from random import randint
+    F=FreeGroup(rang)
+    A=F.alphabet()
+    words=[[A.random_letter() for j in xrange(randint(0,longueur))] for i in xrange(nombre)]
+    reduced=[F(w) for w in words]
+
+    result,lengths=F.reduce_many(words)
+    assert result==reduced, "reduce_many() differs from F(w)"
+    assert list(lengths)==[len(w) for w in reduced]
+
+    data,offsets=pack_words(words,F)
+    (data,offsets),lengths=F.reduce_many(data,offsets)
+    assert unpack_words(data,offsets,F)==[list(w) for w in reduced], "reduce_many() differs from F(w) on packed words"
+    assert list(lengths)==[len(w) for w in reduced]
+    print "rang: ",rang,"longueur: ",longueur," reductions checked"
+
+
+def test_conjugacy(rang,longueur,nombre):
+    """
+    Compares ``canonical_cyclic_form()`` with the least rotation of
+    the cyclic reduction, found by trying all the rotations, on
+    ``nombre`` random words of length ``longueur`` in the free group
+    of rank ``rang``, and checks that conjugate words are detected by
+    ``is_conjugate()``.
+    """
+    F=FreeGroup(rang)
+    for i in xrange(nombre):
+        u=F.subset(longueur).random_element()
+        w=list(u)
+        while len(w)>1 and F.inverse_letter(w[0])==w[-1]:
+            w=w[1:-1]
+        form=min(tuple(w[k:]+w[:k]) for k in xrange(max(len(w),1)))
+        assert u.canonical_cyclic_form()==form, "canonical_cyclic_form() of %s"%u
+        c=F.subset(longueur).random_element()
+        v=c*u*~c
+        assert v.canonical_cyclic_form()==form and u.is_conjugate(v), "%s is conjugate to %s"%(u,v)
+        k=len(w)/2
+        assert F(w[k:]+w[:k]).is_conjugate(u), "%s is conjugate to %s"%(u,F(w[k:]+w[:k]))
+    print "rang: ",rang,"longueur: ",longueur," conjugacy classes checked"
+
+
+def test_lcp(rang,longueur,nombre):
+    """
+    Compares ``lcp()``, ``lcp_many()`` and ``PrefixHashes.lcp()`` with
+    a naive loop on ``nombre`` random words of length at most
+    ``longueur`` in the free group of rank ``rang``, sharing random
+    prefixes with a reference word.
+    """
+    from random import randint
+    F=FreeGroup(rang)
+    A=F.alphabet()
+    reference=[A.random_letter() for j in xrange(longueur)]
+    words=[reference[:randint(0,longueur)]+[A.random_letter() for j in xrange(randint(0,longueur))] for i in xrange(nombre)]
+
+    def naive(u,v):
+        k=0
+        while k<len(u) and k<len(v) and u[k]==v[k]:
+            k+=1
+        return k
+
+    lengths=[naive(reference,w) for w in words]
+    assert [lcp(reference,w) for w in words]==lengths, "lcp() differs from the naive loop"
+    data,offsets=pack_words(words,F)
+    packed_reference,_=pack_words([reference],F)
+    assert list(lcp_many(packed_reference,data,offsets))==lengths, "lcp_many() differs from the naive loop"
+    hashes=PrefixHashes(reference)
+    for w,l in zip(words,lengths):
+        assert hashes.lcp(PrefixHashes(w,base=hashes.base))==l, "PrefixHashes.lcp() differs from the naive loop"
+        k=randint(0,len(w))
+        assert hashes.lcp(PrefixHashes(w,base=hashes.base),k,k)==naive(reference[k:],w[k:])
+    print "rang: ",rang,"longueur: ",longueur," prefixes checked"
+
+
+def test_frozen_word(rang,longueur,nombre):
+    """
+    Freezes ``nombre`` random words (not reduced) of length
+    ``longueur`` in the free group of rank ``rang``.
+
+    Raises an ``AssertionError`` if a frozen word differs from the
+    reduced word, is not shared with the frozen words equal to it or
+    can not be used as a key of a dictionary.
+    """
+    F=FreeGroup(rang)
+    A=F.alphabet()
+    frozen=dict()
+    for i in xrange(nombre):
+        w=[A.random_letter() for j in xrange(longueur)]
+        u=F(w)
+        v=F.frozen_word(w)
+        assert v==u and u==v and list(v)==list(u), "frozen word of %s"%w
+        assert v is u.freeze() and v is F.frozen_word(u) and v.freeze() is v, "frozen word of %s"%w
+        assert hash(v)==hash(F.frozen_word(list(u)))
+        assert frozen.setdefault(v,u)==u
+        assert v*u==u*u and (v*~v).is_one()
+    for v,u in frozen.iteritems():
+        assert frozen[u.freeze()]==u
+    print "rang: ",rang,"longueur: ",longueur," frozen words checked"
+
+
+def test_canonical_form(rang,longueur,nombre):
+    """
+    Compares the canonical forms of the rose representatives of
+    ``nombre`` random automorphisms ``phi`` of length ``longueur`` of
+    the free group of rank ``rang`` and of their conjugates by a
+    random permutation (and inversion) of the letters, which are
+    isomorphic.
+
+    Raises an ``AssertionError`` if the canonical forms or hashes
+    differ, or if the cached canonical form is not updated after a
+    fold.
+    """
+    from random import shuffle,randint
+    F=FreeGroup(rang)
+    A=F.alphabet()
+    positive=list(A.positive_letters())
+    for i in xrange(nombre):
+        phi=F.random_automorphism(longueur)
+        letters=positive[:]
+        shuffle(letters)
+        sigma=dict()
+        for a,b in zip(positive,letters):
+            if randint(0,1)==0: b=A.inverse_letter(b)
+            sigma[a]=b
+            sigma[A.inverse_letter(a)]=A.inverse_letter(b)
+        morph=dict()
+        for a in positive:
+            w=[sigma[b] for b in phi.image(a)]
+            if A.is_positive_letter(sigma[a]):
+                morph[sigma[a]]=F(w)
+            else:
+                morph[A.inverse_letter(sigma[a])]=~F(w)
+        psi=FreeGroupAutomorphism(morph,group=F)
+        f=phi.rose_representative()
+        g=psi.rose_representative()
+        assert f.canonical_form()==g.canonical_form(), "Canonical forms of %s and %s"%(phi,psi)
+        assert f.canonical_hash()==g.canonical_hash()
+
+        if fold_illegal_turn(f) is None: continue
+        form=f.canonical_form()
+        f._canonical=None
+        assert form==f.canonical_form(), "Canonical form of %s after a fold"%f
+    print "rang: ",rang,"longueur: ",longueur," canonical forms checked"
+
+
 def bugs():
     """
     Returns a list of free group automorphisms, that created bugs at
@@ -106,6 +521,63 @@ def bugs():
     return result
 
 
+def memory_report(automorphisms=None,before=None,verbose=True):
+    """
+    Peak memory allocated while computing the stable relative
+    train-track of each automorphism of ``automorphisms`` (by default
+    the list ``bugs()``).
+
+    INPUT:
+
+    - ``before`` -- (default: None) the list returned by
+      ``memory_report()`` for the same automorphisms with another
+      version of this program. If given, the peaks before and after
+      are printed side by side.
+
+    OUTPUT:
+
+    The list of the peaks in bytes, as measured by ``tracemalloc``.
+
+    To compare two versions of this program, run ``memory_report()``
+    with the first one, save the result (for instance with
+    ``save()``) and pass it as ``before`` with the second one.
+
+    WARNING:
+
+    Needs the ``tracemalloc`` module (``pytracemalloc`` for Python 2).
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        raise ImportError("memory_report() needs the tracemalloc module (pytracemalloc for Python 2)")
+
+    if automorphisms is None:
+        automorphisms=bugs()
+    if before is not None and len(before)!=len(automorphisms):
+        raise ValueError("before must have one peak for each automorphism")
+
+    result=[]
+    for i,phi in enumerate(automorphisms):
+        tracemalloc.start()
+        try:
+            phi.train_track(stable=True,relative=True)
+            current,peak=tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result.append(peak)
+        if verbose:
+            if before is None:
+                print i,": peak memory %.1f kB"%(peak/1024.0)
+            else:
+                print i,": peak memory before %.1f kB after %.1f kB (%.2f)"%(before[i]/1024.0,peak/1024.0,float(peak)/before[i])
+    if verbose:
+        if before is None:
+            print "maximum peak memory: %.1f kB"%(max(result)/1024.0)
+        else:
+            print "maximum peak memory: before %.1f kB after %.1f kB"%(max(before)/1024.0,max(result)/1024.0)
+    return result
+
+
 def bug_test():
     bugs_list=bugs()
     for i,phi in enumerate(bugs_list):
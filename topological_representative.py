@@ -4,6 +4,8 @@
 #  Distributed under the terms of the GNU General Public License (GPL) 
 #                  http://www.gnu.org/licenses/ 
 #***************************************************************************** 
+from collections import deque
+from packed_words import PackedEdgeMap
 
 class TopologicalRepresentative(GraphMap):
     """
@@ -38,9 +40,13 @@ class TopologicalRepresentative(GraphMap):
     - Thierry Coulbois (2013-05-16): beta.0 version 
 	 
     """
-
+    __slots__=('_strata','_turn_index','_stratum_index','_clean_strata','_canonical')
 
     def __init__(self,graph,edge_map,vertex_map=None):
+        self._turn_index=None
+        self._stratum_index=None
+        self._clean_strata=None
+        self._canonical=None
         GraphMap.__init__(self,graph,graph,edge_map,vertex_map)
         self._strata=False
 
@@ -178,6 +184,219 @@ class TopologicalRepresentative(GraphMap):
         return TopologicalRepresentative(G,edge_map)
 
 
+    def set_edge_map(self,edge_map,changed=None):
+        """
+        Sets the edge map of ``self`` (see ``GraphMap.set_edge_map()``).
+
+        ``changed`` is the set of the positive edges whose images may
+        have changed, when it is known, so that the turn index of
+        ``self`` only scans these images again and ``update_strata()``
+        only refines the strata of these edges. Edges that are not in
+        the graph anymore need not be in ``changed``. If ``changed``
+        is ``None``, all the images may have changed.
+        """
+        GraphMap.set_edge_map(self,edge_map)
+        if self._turn_index is not None:
+            self._turn_index.invalidate(changed)
+        if self._clean_strata is not None:
+            if changed is None:
+                self._clean_strata=None
+            else:
+                self._clean_strata[1].update(changed)
+
+    def turn_index(self):
+        """
+        The ``TurnIndex`` of the turns in the images of the edges of
+        ``self``.
+
+        The index is built once, then it is updated when the edge
+        map of ``self`` has been changed: only the images of the edges
+        that have changed are scanned again.
+        """
+        if self._turn_index is None:
+            self._turn_index=TurnIndex()
+        index=self._turn_index
+        if index._edge_map is not self._edge_map:
+            index.update(self._edge_map,self._images()[0],self._domain._alphabet)
+        return index
+
+    def turn_frequencies(self):
+        """
+        A dictionary that maps each turn in the image of an edge to
+        its number of occurrences in the images of the edges.
+        """
+        return self.turn_index().frequencies()
+
+    def canonical_form(self):
+        """
+        A certificate of ``self`` up to the renaming of its edges and
+        vertices.
+
+        Two topological representatives have the same canonical form
+        if and only if there is a bijection between their vertices
+        and their edges (possibly reversing the orientation of some
+        edges) that maps the graph, the edge map and the strata of
+        the first one to those of the second one.
+
+        The edges, in both orientations, and the vertices are
+        coloured by their stratum, the length of their image and their
+        incidences, and the colours are refined until they are
+        stable. Ties are broken by individualizing in turn each edge
+        of the smallest colour class, and the least certificate is
+        kept. Branches that are the image of an already explored one
+        by an automorphism of ``self`` are skipped.
+
+        The certificate is cached until the edge map or the strata of
+        ``self`` change.
+
+        OUTPUT:
+
+        A tuple ``(number of vertices, edges)`` where ``edges`` gives,
+        for the ``i``-th edge of the canonical labelling, its initial
+        and terminal vertices, its stratum and its image coded as a
+        tuple of integers: ``i+1`` for the ``i``-th edge and ``-i-1``
+        for its inverse.
+
+        EXAMPLES::
+
+        sage: phi=FreeGroupAutomorphism("a->ab,b->ac,c->a",FreeGroup(3))
+        sage: psi=FreeGroupAutomorphism("b->bc,c->ba,a->b",FreeGroup(3))
+        sage: f=phi.rose_representative()
+        sage: f.canonical_form()==psi.rose_representative().canonical_form()
+        True
+        sage: f.canonical_form()
+        (1, ((0, 0, 0, (-3,)), (0, 0, 0, (1, -3)), (0, 0, 0, (3, -2))))
+
+        SEE ALSO:
+
+        ``canonical_hash()``
+        """
+        if self._strata:
+            strata=tuple(frozenset(s) for s in self._strata)
+        else:
+            strata=None
+        if self._canonical is not None and self._canonical[0] is self._edge_map and self._canonical[1]==strata:
+            return self._canonical[2]
+
+        G=self._domain
+        A=G.alphabet()
+        images=self._images()[0]
+        darts=list(A)
+        inverse=dict((a,A.inverse_letter(a)) for a in darts)
+        initial=dict((a,G.initial_vertex(a)) for a in darts)
+        if strata:
+            stratum=dict((a,self.stratum(a)) for a in darts)
+        else:
+            stratum=dict((a,0) for a in darts)
+        vertices=list(set(initial.itervalues()))
+        outgoing=dict((v,[]) for v in vertices)
+        for a in darts:
+            outgoing[initial[a]].append(a)
+        occurrences=dict((a,[]) for a in darts) # where a occurs in the images
+        for b in darts:
+            for i,a in enumerate(images[b]):
+                occurrences[a].append((b,i))
+
+        def rank(signature):
+            index=dict((s,i) for i,s in enumerate(sorted(set(signature.itervalues()))))
+            return dict((x,index[s]) for x,s in signature.iteritems()),len(index)
+
+        def refine(dcol,vcol):
+            n=len(set(dcol.itervalues()))+len(set(vcol.itervalues()))
+            while True:
+                dsig=dict((a,(dcol[a],dcol[inverse[a]],vcol[initial[a]],
+                              tuple(dcol[b] for b in images[a]),
+                              tuple(sorted((dcol[b],i) for (b,i) in occurrences[a]))))
+                          for a in darts)
+                vsig=dict((v,(vcol[v],tuple(sorted(dcol[a] for a in outgoing[v]))))
+                          for v in vertices)
+                dcol,dn=rank(dsig)
+                vcol,vn=rank(vsig)
+                if dn+vn==n:
+                    return dcol,vcol
+                n=dn+vn
+
+        def leaf(dcol,vcol):
+            positive=sorted((a for a in darts if dcol[a]<dcol[inverse[a]]),key=dcol.get)
+            code={}
+            for i,a in enumerate(positive):
+                code[a]=i+1
+                code[inverse[a]]=-i-1
+            vcode=dict((v,i) for i,v in enumerate(sorted(vertices,key=vcol.get)))
+            edges=tuple((vcode[initial[a]],vcode[initial[inverse[a]]],stratum[a],
+                         tuple(code[b] for b in images[a]))
+                        for a in positive)
+            return (len(vertices),edges),code
+
+        automorphisms=[]
+        leaves={} # certificate -> labelling of the first leaf with it
+        best=[None]
+
+        def search(dcol,vcol,fixed):
+            dcol,vcol=refine(dcol,vcol)
+            cells={}
+            for a in darts:
+                cells.setdefault(dcol[a],[]).append(a)
+            cell=min([(len(c),k) for k,c in cells.iteritems() if len(c)>1] or [None])
+            if cell is None:
+                certificate,code=leaf(dcol,vcol)
+                if certificate in leaves:
+                    first=dict((c,a) for a,c in leaves[certificate].iteritems())
+                    automorphisms.append(dict((a,first[code[a]]) for a in darts))
+                else:
+                    leaves[certificate]=code
+                if best[0] is None or certificate<best[0]:
+                    best[0]=certificate
+                return
+            cell=cells[cell[1]]
+            # orbits of cell under the automorphisms that fix the
+            # individualized edges, as a union-find forest
+            orbit=dict((a,a) for a in cell)
+            def root(a):
+                while orbit[a]!=a:
+                    orbit[a]=orbit[orbit[a]]
+                    a=orbit[a]
+                return a
+            known=0
+            explored=set()
+            for a in cell:
+                for p in automorphisms[known:]:
+                    if all(p[x]==x for x in fixed):
+                        for x in cell:
+                            orbit[root(x)]=root(p[x])
+                known=len(automorphisms)
+                if root(a) in set(root(b) for b in explored):
+                    continue
+                d=dict((b,2*c+1) for b,c in dcol.iteritems())
+                d[a]=2*dcol[a]
+                search(d,vcol,fixed+[a])
+                explored.add(a)
+
+        dcol,n=rank(dict((a,(stratum[a],len(images[a]))) for a in darts))
+        vcol=dict((v,0) for v in vertices)
+        search(dcol,vcol,[])
+
+        self._canonical=(self._edge_map,strata,best[0])
+        return best[0]
+
+    def canonical_hash(self):
+        """
+        A hash of ``self`` up to the renaming of its edges and
+        vertices.
+
+        This is the hash of ``canonical_form()``: two topological
+        representatives that are the same up to renaming have the
+        same hash.
+
+        EXAMPLES::
+
+        sage: phi=FreeGroupAutomorphism("a->ab,b->ac,c->a",FreeGroup(3))
+        sage: psi=FreeGroupAutomorphism("b->bc,c->ba,a->b",FreeGroup(3))
+        sage: phi.rose_representative().canonical_hash()==psi.rose_representative().canonical_hash()
+        True
+        """
+        return hash(self.canonical_form())
+
     def matrix(self):
         """
         Incidence matrix of ``self``. 
@@ -185,13 +404,9 @@ class TopologicalRepresentative(GraphMap):
         The indices of the matrix are determined by the order in the
         alphabet.
         """
-        A=self._domain._alphabet
-        m=len(A.positive_letters())
-        M=matrix(m)
-        for i,a in enumerate(A.positive_letters()):
-            for b in self.image(a):
-                M[A.rank(A.to_positive_letter(b)),i]+=1
-        return M
+        packed=PackedEdgeMap(self.image,self._domain._alphabet)
+        m=len(packed)
+        return matrix(m,m,packed.counts().ravel().tolist())
      
     def expansion_factor(self,stratum=None):
         """
@@ -266,20 +481,12 @@ class TopologicalRepresentative(GraphMap):
 
         """
         A=self._domain._alphabet
-        turns=[]
+        index=self.turn_index()
         source={}
-        for e in A.positive_letters(): # Builds the list of turns in the image of the edges
-            w=self.image(e)
-            for i in xrange(len(w)-1):
-                x=A.inverse_letter(w[i])
-                y=w[i+1]
-                if A.less_letter(y,x): 
-                    tmp=x
-                    x=y
-                    y=tmp
-                if (x,y) not in turns:
-                    turns.append((x,y))
-                    source[(x,y)]=[[e,i+1]]
+        for t in index.turns(): # The first occurrence of each turn in the image of the edges
+            e=min(index.occurrences(t),key=A.rank)
+            source[t]=[[e,index.positions(t,e)[0]]]
+        turns=sorted(source,key=lambda t:(A.rank(source[t][0][0]),source[t][0][1]))
         done=False
         traintrack=True
         while not done:
@@ -329,33 +536,50 @@ class TopologicalRepresentative(GraphMap):
         this has no effect on the possible strata of self.
         """
 
+        images=_EdgeImages(self)
+        subdivide_morph=self._subdivide_images(images,edge_list,verbose)
+        self.set_edge_map(images.images,images.changed)
+
+        if verbose: print "\n",self
+
+        return subdivide_morph
+
+    def _subdivide_images(self,images,edge_list,verbose=False):
+        """
+        Subdivides the edges of ``edge_list`` as ``subdivide()`` but
+        only updates ``images`` (an ``_EdgeImages``) and not the edge
+        map of ``self``.
+
+        Only the images that cross a subdivided edge are rewritten.
+        """
+
         if verbose: print "Subdivide edges: ",edge_list
 
+        A=self._domain.alphabet()
+        old_images=dict((e,images.image(e)) for e in edge_list)
+        subdivided=set(A.to_positive_letter(e) for e in edge_list)
+        crossing=images.crossing(subdivided).difference(subdivided)
+
         subdivide_dict=self._domain.subdivide(edge_list)
         subdivide_morph=WordMorphism(subdivide_dict)
 
-        result={}
-        for e in self._edge_map.domain().alphabet():
-            if len(subdivide_dict[e])==1:
-                a=subdivide_dict[e][0]
-                aa=self._domain._alphabet.inverse_letter(a)
-                result[a]=subdivide_morph(self.image(e))
-                result[aa]=self._codomain.reverse_path(result[a])
+        result=[]
+        for e in crossing:
+            result.append((e,subdivide_morph(images.image(e))))
 
         for e in edge_list:
             a=subdivide_dict[e][0]
             b=subdivide_dict[e][1]
-            if len(self.image(e))>1:
-                result[a]=subdivide_dict[self.image(e)[0]]
-                result[b]=subdivide_morph(self.image(e)[1:])
+            w=old_images[e]
+            if len(w)>1:
+                result.append((a,subdivide_dict[w[0]]))
+                result.append((b,subdivide_morph(w[1:])))
             else:
-                result[a]=subdivide_dict[self.image(e)[0]][:1]
-                result[b]=subdivide_dict[self.image(e)[0]][1:2]
-                            
-        self.set_edge_map(result)
-
+                result.append((a,subdivide_dict[w[0]][:1]))
+                result.append((b,subdivide_dict[w[0]][1:2]))
 
-        if verbose: print "\n",self
+        for a,w in result:
+            images.set_image(a,w)
 
         return subdivide_morph
 
@@ -436,6 +660,13 @@ class TopologicalRepresentative(GraphMap):
 
         Beware this has no effect on the possible strata of self.
 
+        The images of the edges are kept aside during the folds and
+        subdivisions and the edge map of ``self`` is set only once at
+        the end. The graph itself is still folded one turn at a time:
+        the turn folded at each step, and the length of the fold, are
+        read on the images left by the previous fold, so that the
+        chain of folds can not be planned beforehand.
+
         REFERENCES:
 
         [BH-train-track] M. Bestvina, M. Handel, Train tracks and
@@ -449,6 +680,8 @@ class TopologicalRepresentative(GraphMap):
 
         result_morph=False
 
+        images=_EdgeImages(self)
+
         while len(turns)>1:
             
             if verbose:
@@ -457,8 +690,8 @@ class TopologicalRepresentative(GraphMap):
             turn=turns[-1]
             avoid=turns[0]
 
-            u=self.image(turn[0])
-            v=self.image(turn[1])
+            u=images.image(turn[0])
+            v=images.image(turn[1])
 
             prefix_length=self._domain.common_prefix_length(u,v)
             prefix=u[:prefix_length]
@@ -468,7 +701,7 @@ class TopologicalRepresentative(GraphMap):
             if isinstance(avoid,list):
                 position=avoid[1]
                 edge=avoid[0]
-                w=self.image(edge)
+                w=images.image(edge)
 
 
                 redge=self._domain._alphabet.inverse_letter(edge)
@@ -516,14 +749,14 @@ class TopologicalRepresentative(GraphMap):
                 done=False
                 while not done:
                     done=True
-                    x=self.image(subdivide[-1])
+                    x=images.image(subdivide[-1])
                     if len(x)==1: 
                         subdivide.append(x[0])
                         done=False
  
                 if isinstance(avoid,list): avoid_image=w[0:position]
 
-                subdivide_morph=self.subdivide(subdivide,verbose)
+                subdivide_morph=self._subdivide_images(images,subdivide,verbose)
 
                 if result_morph:
                     result_morph=subdivide_morph*result_morph
@@ -538,12 +771,12 @@ class TopologicalRepresentative(GraphMap):
                     subdivide_avoid=subdivide_morph.image(avoid[0])
                     avoid_position=len(subdivide_morph(avoid_image))
                     k=1
-                    while len(self(subdivide_avoid[0:k]))<avoid_position: k=k+1
+                    while len(images(subdivide_avoid[0:k]))<avoid_position: k=k+1
                     avoid=subdivide_avoid[k-1]
-                    if len(self(subdivide_avoid[0:k]))==avoid_position:
+                    if len(images(subdivide_avoid[0:k]))==avoid_position:
                         avoid=(self._domain.alphabet().inverse_letter(avoid),subdivide_avoid[k])
                     else:
-                        avoid=[avoid,len(self(subdivide_avoid[0:k]))-avoid_position]
+                        avoid=[avoid,len(images(subdivide_avoid[0:k]))-avoid_position]
                 else:
                     avoid=(subdivide_morph.image(avoid[0])[0],subdivide_morph.image(avoid[1])[0])
 
@@ -552,7 +785,7 @@ class TopologicalRepresentative(GraphMap):
             else:
                 prefix=prefix[:prefix_length]
 
-            fold_morph=self.fold(turns[-1],prefix,verbose=verbose)
+            fold_morph=self._fold_images(images,turns[-1],prefix,verbose=verbose)
 
             better=False #No edge in turns is mapped to a point.
 
@@ -578,22 +811,13 @@ class TopologicalRepresentative(GraphMap):
                 if isinstance(turns[0],tuple):
                     if len(turns)==1:  # Tighten at the avoid vertex (which has valence 2)
                     
-                        tighten_length=self._domain.common_prefix_length(self.image(turns[0][0]),self.image(turns[0][1]))
+                        tighten_length=self._domain.common_prefix_length(images.image(turns[0][0]),images.image(turns[0][1]))
                         if tighten_length>0:  #not necessary ?
                             if verbose: print "Tighten at ",self._domain.initial_vertex(turns[0][0])
-                            edge_map=dict((a,self.image(a)) for a in self._domain._alphabet)
                             a=turns[0][0]
                             b=turns[0][1]
-                            aa=self._domain.alphabet().inverse_letter(a)
-                            bb=self._domain.alphabet().inverse_letter(b)
-                            edge_map[a]=edge_map[a][tighten_length:]
-                            edge_map[b]=edge_map[b][tighten_length:]
-                            edge_map[aa]=self._domain.reverse_path(edge_map[a])
-                            edge_map[bb]=self._domain.reverse_path(edge_map[b])
-
-                            self.set_edge_map(edge_map)
-
-                            if verbose: print "\n",self
+                            images.set_image(a,images.image(a)[tighten_length:])
+                            images.set_image(b,images.image(b)[tighten_length:])
 
                     else:
                         u=fold_morph.image(turns[0][0])
@@ -605,17 +829,21 @@ class TopologicalRepresentative(GraphMap):
 
 
                 elif len(turns)>1:
-                    b=self._domain.alphabet().inverse_letter(turns[1][0])
-                    c=self._domain.alphabet().inverse_letter(turns[1][1])
+                    A=self._domain.alphabet()
+                    t=turns[1]
+                    if A.less_letter(t[1],t[0]):
+                        t=(t[1],t[0])
                     done=False
                     for a in fold_morph.image(turns[0][0]):
-                        if done: break
-                        w=self.image(a)
-                        for i in xrange(len(w)-1):
-                            if (w[i]==b and w[i+1]==turns[1][1]) or (w[i]==c and w[i+1]==turns[1][0]):
-                                turns[0]=[a,i+1]
-                                done=True
-                                break
+                        e=A.to_positive_letter(a)
+                        positions=images.turn_index.positions(t,e)
+                        if len(positions)>0:
+                            if a==e:
+                                turns[0]=[a,positions[0]]
+                            else: # first occurrence in the reversed image
+                                turns[0]=[a,images.turn_index.image_length(e)-positions[-1]]
+                            done=True
+                            break
                     if not done: #the avoid vertex is one of the extremities thus there was some folding in the avoid edge
                         turns=turns[:1] #We can stop the loop
 
@@ -626,6 +854,10 @@ class TopologicalRepresentative(GraphMap):
             else:
                 result_morph=fold_morph
 
+        self.set_edge_map(images.images,images.changed)
+
+        if verbose: print "\n",self
+
         return result_morph
 
 
@@ -651,6 +883,21 @@ class TopologicalRepresentative(GraphMap):
 
         Beware this has no effect on the possible strata of self.
 
+        EXAMPLES:
+
+        The edge ``b`` is fully folded along ``a``, and the images of
+        the two edges cross ``b``::
+
+        sage: phi=FreeGroupAutomorphism("a->ab,b->a",FreeGroup(2))
+        sage: f=phi.rose_representative()
+        sage: f.fold(('a','b'),Word(['a']))
+        WordMorphism: A->AB, B->B, a->ba, b->b
+        sage: print f
+        Topological representative:
+        Marked graph: a: 0->0, b: 0->0
+        Marking: a->ba, b->b
+        Edge map: a->b, b->ba
+
         REFERENCES:
 
         [BH-train-track] M. Bestvina, M. Handel, Train tracks and
@@ -658,7 +905,21 @@ class TopologicalRepresentative(GraphMap):
 
         """
 
-        A=self._domain.alphabet()
+        images=_EdgeImages(self)
+        fold_morph=self._fold_images(images,turn,common_prefix,verbose)
+        self.set_edge_map(images.images,images.changed)
+
+        if verbose: print "\n",self
+
+        return fold_morph
+
+    def _fold_images(self,images,turn,common_prefix,verbose=False):
+        """
+        Folds the ``turn`` as ``fold()`` but only updates ``images``
+        (an ``_EdgeImages``) and not the edge map of ``self``.
+
+        Only the images that cross a folded edge are rewritten.
+        """
 
         if verbose:
             print "Fold: ",turn," common prefix ", common_prefix
@@ -672,31 +933,38 @@ class TopologicalRepresentative(GraphMap):
             if isinstance(e,tuple) and e[1]=='path':
                 full_edges.insert(0,e)
                 l=len(e[0])
-            elif len(self.image(e))==common_prefix_length:
+            elif len(images.image(e))==common_prefix_length:
                 full_edges.append(e)
             else:
                 partial_edges.append(e)
 
+        old_edges=images.images.keys()
+        partial_images=[images.image(e) for e in partial_edges]
+
         fold_map=self._domain.fold(full_edges,partial_edges)
         fold_morph=WordMorphism(fold_map)
 
-        edge_map={}
+        folded=[e for e in old_edges if len(fold_map[e])!=1 or fold_map[e][0]!=e]
+
+        result=[]
         if len(full_edges)==0:
-            edge_map[fold_morph.image(partial_edges[0])[0]]=fold_morph(common_prefix)
-        for e in partial_edges:
+            result.append((fold_morph.image(partial_edges[0])[0],fold_morph(common_prefix)))
+        for e,w in zip(partial_edges,partial_images):
             if len(fold_morph.image(e))==2*l+1: # e and its inverse have been fold
-                edge_map[fold_morph.image(e)[l]]=fold_morph(self.image(e)[common_prefix_length:-common_prefix_length])
+                result.append((fold_morph.image(e)[l],fold_morph(w[common_prefix_length:-common_prefix_length])))
             else:
-                edge_map[fold_morph.image(e)[l]]=fold_morph(self.image(e)[common_prefix_length:])
-        for e in fold_map:
+                result.append((fold_morph.image(e)[l],fold_morph(w[common_prefix_length:])))
+        for e in images.crossing(folded).union(folded):
             f=fold_map[e]
             if len(f)==1:
-                f=f[0]
-                edge_map[f]=fold_morph(self.image(e))
+                result.append((f[0],fold_morph(images.image(e))))
 
-        self.set_edge_map(edge_map)
-
-        if verbose: print "\n",self
+        for a,w in result:
+            images.set_image(a,w)
+        A=self._domain.alphabet()
+        for e in folded:
+            if e not in A:
+                images.remove(e)
 
         return fold_morph
 
@@ -1111,6 +1379,36 @@ class TopologicalRepresentative(GraphMap):
         return result_morph
 
 
+    def compact_alphabet(self,verbose=False):
+        """
+        Renames the edges of ``self`` with the first letters of its
+        alphabet.
+
+        The edge map, the marking and the strata of ``self`` are
+        renamed accordingly. Long computations remove and add many
+        edges, they call this method when the alphabet has more
+        removed letters than letters.
+
+        OUTPUT:
+
+        The ``WordMorphism`` that maps old edges to new edges.
+
+        SEE ALSO:
+
+        ``AlphabetWithInverses.compact()``
+        """
+        G=self._domain
+        A=G.alphabet()
+        images=dict((a,self.image(a)) for a in A.positive_letters())
+        renaming=A.compact()
+        G.rename_edges(renaming)
+        self.set_edge_map(dict((renaming[a],Word([renaming[b] for b in images[a]])) for a in images))
+        if self._strata:
+            self._strata=[set(renaming[a] for a in stratum) for stratum in self._strata]
+        if verbose:
+            print "Compact alphabet: ",A
+        return WordMorphism(dict((a,Word([renaming[a]])) for a in renaming))
+
     def train_track(self,verbose=False):
         """ 
         Computes an absolute train-track representative for the
@@ -1128,6 +1426,7 @@ class TopologicalRepresentative(GraphMap):
 
         """
         done=False
+        A=self._domain.alphabet()
 
         result_morph=self.reduce(verbose)
 
@@ -1154,6 +1453,9 @@ class TopologicalRepresentative(GraphMap):
                 tmp_morph=self.reduce(verbose)
                 if tmp_morph:
                     result_morph=tmp_morph*result_morph
+
+                if A.holes()>len(A):
+                    result_morph=self.compact_alphabet(verbose)*result_morph
                 
                 done=len(self._strata)>1
 
@@ -1248,15 +1550,8 @@ class TopologicalRepresentative(GraphMap):
         new=[]
 
         if stratum==None:
-            for a in A.positive_letters():
-                u=self.image(a)
-                for i in xrange(len(u)-1):
-                    t=(A.inverse_letter(u[i]),u[i+1])
-                    if not A.less_letter(t[0],t[1]):
-                        t=(t[1],t[0])
-                    if t not in result:
-                        result.add(t)
-                        new.append(t)
+            new=self.turn_index().turns()
+            result.update(new)
 
         else:
             for a in self._strata[stratum]:
@@ -1412,8 +1707,6 @@ class TopologicalRepresentative(GraphMap):
         A=G._alphabet
 
         result=[]
-        image=[]
-        next=[]
         
         extension=dict((a,[]) for a in A)
 
@@ -1422,20 +1715,17 @@ class TopologicalRepresentative(GraphMap):
             extension[A.inverse_letter(t[0])].append(t[1]) 
             extension[A.inverse_letter(t[1])].append(t[0])
                   
+        # Each pending record is a tuple (t,tt,ext): the pair of
+        # paths, the tightened image of the pair and the letters to
+        # add to the paths. The next record to extend is the last one.
         fold_turns=self.fold_turns()
-        for t in fold_turns:
-            result.append((Word(),Word()))
-            image.append((Word(),Word())) #tigthen image of result
-            next.append((t[0],t[1])) #letters to add to result
+        pending=[((Word(),Word()),(Word(),Word()),(t[0],t[1])) for t in reversed(fold_turns)]
               
         u=[None,None]
         uu=[None,None]
                      
-        i=0
-        while i<len(result):
-            t=result.pop(i)
-            tt=image.pop(0)
-            ext=next.pop(0)
+        while pending:
+            t,tt,ext=pending.pop()
 
             for j in xrange(2):
                 if ext[j]!=None:
@@ -1447,39 +1737,30 @@ class TopologicalRepresentative(GraphMap):
 
             t=(u[0],u[1])
             p=G.common_prefix_length(uu[0],uu[1])                
-            tt=(uu[0][p:],uu[1][p:])
+            tt=(_PathView(uu[0],p),_PathView(uu[1],p))
             
             if verbose: print t[0],t[1]," image: ", tt[0],",",tt[1]
 
             if len(tt[0])==0:
                 for a in extension[t[0][-1]]:
-                    result.insert(i,t)
-                    image.insert(0,tt)
-                    next.insert(0,(a,None))
+                    pending.append((t,tt,(a,None)))
                     
             elif len(tt[1])==0:
                 for a in extension[t[1][-1]]:
-                    result.insert(i,t)
-                    image.insert(0,tt)
-                    next.insert(0,(None,a))
+                    pending.append((t,tt,(None,a)))
 
                                         
             elif (G.is_prefix(t[0],tt[0]) and G.is_prefix(t[1],tt[1])): 
-                    result.insert(i,t)
+                    result.append(t)
                     if verbose: print "inp"
-                    i+=1
                 
             elif G.is_prefix(tt[0],t[0]) and (G.is_prefix(t[1],tt[1]) or G.is_prefix(tt[1],t[1])):
                 for a in extension[t[0][-1]]:
-                    result.insert(i,t)
-                    image.insert(0,tt)
-                    next.insert(0,(a,None)) 
+                    pending.append((t,tt,(a,None)))
 
             elif G.is_prefix(tt[1],t[1]) and G.is_prefix(t[0],tt[0]):
                 for a in extension[t[1][-1]]:
-                    result.insert(i,t)
-                    image.insert(0,tt)
-                    next.insert(0,(None,a)) 
+                    pending.append((t,tt,(None,a)))
 
         return result
     
@@ -1540,7 +1821,7 @@ class TopologicalRepresentative(GraphMap):
 
             t=(u[0],u[1])
             p=G.common_prefix_length(uu[0],uu[1])                
-            tt=(uu[0][p:],uu[1][p:])
+            tt=(_PathView(uu[0],p),_PathView(uu[1],p))
             
             if verbose: print t[0],",",t[1],"iteration:",iter,"image:", tt[0],",",tt[1]
 
@@ -1603,13 +1884,13 @@ class TopologicalRepresentative(GraphMap):
                         result.append(ot)
                         k=illegal_iter[j]
                         if len(ott[0])>0:
-                            u[0]=self._edge_map(ott[0],k)
+                            u[0]=self._edge_map(Word(list(ott[0])),k)
                         else: u[0]=Word()
                         if len(ott[1])>0:
-                            u[1]=self._edge_map(ott[1],k)
+                            u[1]=self._edge_map(Word(list(ott[1])),k)
                         else: u[1]=Word()
                         p=G.common_prefix_length(u[0],u[1])
-                        image.append((u[0][p:],u[1][p:]))
+                        image.append((_PathView(u[0],p),_PathView(u[1],p)))
                         next.append(ext)
                         iteration.append(iter+illegal_iter[j])
 
@@ -1682,7 +1963,7 @@ class TopologicalRepresentative(GraphMap):
 
             t=(u[0],u[1])
             p=G.common_prefix_length(uu[0],uu[1])                
-            tt=(uu[0][p:],uu[1][p:])
+            tt=(_PathView(uu[0],p),_PathView(uu[1],p))
             
             if verbose: print t[0],t[1]," image: ", tt[0],",",tt[1]
 
@@ -1813,7 +2094,7 @@ class TopologicalRepresentative(GraphMap):
             u=Word([a for b in t[0] for a in self.image(b) if a in extension])
             v=Word([a for b in t[1] for a in self.image(b) if a in extension])
             p=G.common_prefix_length(u,v)
-            tt=(u[p:],v[p:])
+            tt=(_PathView(u,p),_PathView(v,p))
             new_t=[]
             for j in xrange(2):
                 a=t[j][-1:]
@@ -1843,10 +2124,10 @@ class TopologicalRepresentative(GraphMap):
             u=self(new_t[0])
             v=self(new_t[1])
             p=G.common_prefix_length(u,v)
-            tt=(u[p:],v[p:])
+            tt=(_PathView(u,p),_PathView(v,p))
             if (G.is_prefix(new_t[0],tt[0]) and G.is_prefix(new_t[1],tt[1])):
                 if verbose: print "INP:",new_t
-                result[i]=new_t
+                result[i]=tuple(new_t)
                 i+=1
             else:
                 result.pop(i)
@@ -1997,9 +2278,9 @@ class TopologicalRepresentative(GraphMap):
                     result_morph=folding_morph*result_morph
                 else:
                     result_morph=folding_morph
-                inp=[folding_morph(inp[0]),folding_morph(inp[1])]
+                inp=(folding_morph(inp[0]),folding_morph(inp[1]))
                 prefix_length=self._domain.common_prefix_length(inp[0],inp[1])
-                inp=[inp[0][prefix_length:],inp[1][prefix_length:]]
+                inp=(inp[0][prefix_length:],inp[1][prefix_length:])
             else:
                 if verbose: print "Partial fold"
                 full_edges=[]
@@ -2064,14 +2345,10 @@ class TopologicalRepresentative(GraphMap):
         The incidence matrix of the stratum ``i`` of ``self``.
         """
 
-        M=matrix(len(self._strata[s]))
-        index=dict((a,j) for j,a in enumerate(self._strata[s]))
-        for j,a in enumerate(self._strata[s]):
-            for b in self.image(a):
-                b=self._domain._alphabet.to_positive_letter(b)
-                if b in self._strata[s]:
-                    M[index[b],j]+=1
-        return M
+        A=self._domain._alphabet
+        indices=[A.rank(a) for a in self._strata[s]]
+        m=len(indices)
+        return matrix(m,m,PackedEdgeMap(self.image,A).counts(indices).ravel().tolist())
    
     def filtre_stratum(self,s,verbose=False):
         """
@@ -2159,6 +2436,12 @@ class TopologicalRepresentative(GraphMap):
 
         a dictionnary that maps the index of an old strata ``s`` to the
         indices of the new strata that inherit from ``s``.
+
+        ALGORITHM:
+
+        A stratum is refined only if it has changed, or if the image
+        of one of its edges has changed, since it was last found
+        irreducible: other strata are still irreducible.
         """
 
         A=self._domain.alphabet()
@@ -2171,14 +2454,27 @@ class TopologicalRepresentative(GraphMap):
                 self._strata[s].difference_update(below)
                 below.update(self._strata[s])
 
-        heritage={}
+        if self._clean_strata is None:
+            clean,changed=set(),set()
+        else:
+            clean,changed=self._clean_strata
 
-        result_strata=[]
+        heritage={}
+        new_clean=set()
         shift=0
         for s in xrange(len(self._strata)):
-            n=self.filtre_stratum(s+shift,verbose)
+            stratum=frozenset(self._strata[s+shift])
+            if stratum in clean and changed.isdisjoint(stratum):
+                n=1
+            else:
+                n=self.filtre_stratum(s+shift,verbose)
+            if n==1:
+                new_clean.add(frozenset(self._strata[s+shift]))
             heritage[s]=[s+shift+i for i in xrange(n)]
             shift+=n-1
+
+        self._clean_strata=(new_clean,set())
+        self._stratum_index=dict((a,s) for s,stratum in enumerate(self._strata) for a in stratum)
             
         if verbose: 
             if (morph or shift>0): 
@@ -2206,29 +2502,29 @@ class TopologicalRepresentative(GraphMap):
 
         If the ``s`` stratum of ``self`` satisfies RTT-iii, returns an empty list.
 
+        EXAMPLES:
+
+        The turn ``('b','A')`` in the image of ``a`` is mapped to the
+        degenerate turn ``('B','B')``::
+
+        sage: phi=FreeGroupAutomorphism("a->BAb,b->BA",FreeGroup(2))
+        sage: f=phi.rose_representative()
+        sage: f._strata=[set(['a','b'])]
+        sage: f.find_relative_folding(0)
+        [['a', 1], ('b', 'A')]
+
         """
         A=self._domain.alphabet()
-        turns=[]
+        stratum=self._strata[s]
+        index=self.turn_index()
+        order=dict((e,i) for i,e in enumerate(stratum))
         source={}
-        for e in self._strata[s]: # Builds the list of turns in the image of the edges
-            w=self.image(e)
-            i=0
-            while i<len(w)-1:
-                if A.to_positive_letter(w[i]) not in self._strata[s]: 
-                    i=i+1
-                elif A.to_positive_letter(w[i+1]) not in self._strata[s]: 
-                    i=i+2
-                else:
-                    x=A.inverse_letter(w[i])
-                    y=w[i+1]
-                    if A.less_letter(y,x): 
-                        tmp=x
-                        x=y
-                        y=tmp
-                        if (x,y) not in turns:
-                            turns.append((x,y))
-                            source[(x,y)]=[[e,i+1]]
-                    i=i+1
+        for t in index.turns(): # The first occurrence of each turn of the stratum in the image of its edges
+            if A.to_positive_letter(t[0]) in stratum and A.to_positive_letter(t[1]) in stratum:
+                for e,positions in index.occurrences(t).iteritems():
+                    if e in stratum and (t not in source or order[e]<order[source[t][0][0]]):
+                        source[t]=[[e,positions[0]]]
+        turns=sorted(source,key=lambda t:(order[source[t][0][0]],source[t][0][1]))
         done=False
         traintrack=True
         while not done:
@@ -2279,52 +2575,52 @@ class TopologicalRepresentative(GraphMap):
         """
 
         A=self._domain.alphabet()
-        Dfinverse=dict((e,[]) for e in self._strata[s])
-        subdivide=[]
-
-        for e in self._strata[s]:
-            Dfinverse[A.inverse_letter(e)]=[]
+        stratum=self._strata[s]
 
-        for e in self._strata[s]:
-            f=self.image(e)[0]
-            if f in Dfinverse:
-                Dfinverse[f].append(e)
-            else:
-                subdivide.append(e)
-            ee=A.inverse_letter(e)
-            ff=self.image(ee)[0]
-            if ff in Dfinverse:
-                Dfinverse[ff].append(ee)
-            else:
-                subdivide.append(ee)
+        # Dfinverse maps a letter of the stratum to the letters of the
+        # stratum whose image starts with it
+        Dfinverse=dict()
+        subdivide=[]
+        for e in stratum:
+            for a in (e,A.inverse_letter(e)):
+                f=self.image(a)[0]
+                if A.to_positive_letter(f) in stratum:
+                    if f in Dfinverse:
+                        Dfinverse[f].append(a)
+                    else:
+                        Dfinverse[f]=[a]
+                else:
+                    subdivide.append(a)
 
-        new=subdivide[:]
+        new=deque(subdivide)
         while len(new)>0:
-            nnew=[]
-            for e in new:
-                for f in Dfinverse[e]:
-                    subdivide.append(f)
-                nnew=nnew+Dfinverse[e]
-            new=nnew
+            for f in Dfinverse.get(new.popleft(),[]):
+                subdivide.append(f)
+                new.append(f)
 
-        subdivide_inverse=[A.inverse_letter(a) for a in subdivide]
+        subdivided=set(subdivide)
+        subdivided_inverse=set(A.inverse_letter(a) for a in subdivide)
 
         if len(subdivide)>0:
             if verbose: print "Core subdivision of stratum",s,": subdivide edges: ",subdivide
+            letter_images=self._images()[0]
+            images=dict((e,self.image(e)) for e in A.positive_letters())
             subdivide_map=self._domain.subdivide(subdivide)
             subdivide_morph=WordMorphism(subdivide_map)
 
             edge_map={}
+            lower_stratum=set()
+            stratum_s=set()
 
-            for e in self._strata[s]:
-
-                if e in subdivide and e in subdivide_inverse:
-                    w=self.image(e)
+            for e in stratum:
+                w=images[e]
+                if e in subdivided or e in subdivided_inverse:
                     i=0
-                    while w[i] not in Dfinverse: i=i+1     
+                    while A.to_positive_letter(w[i]) not in stratum: i=i+1
                     j=len(w)-1
-                    while w[j] not in Dfinverse: j=j-1
+                    while A.to_positive_letter(w[j]) not in stratum: j=j-1
 
+                if e in subdivided and e in subdivided_inverse:
                     a=subdivide_map[e][0]
                     b=subdivide_map[e][1]
                     c=subdivide_map[e][2]
@@ -2333,80 +2629,64 @@ class TopologicalRepresentative(GraphMap):
                     edge_map[b]=subdivide_morph(w[i:j+1])
                     edge_map[c]=subdivide_morph(w[j+1:])
 
-                    if w[i] in subdivide:
+                    if w[i] in subdivided:
                         edge_map[a]=edge_map[a]*subdivide_map[w[i]][0:1]
                         edge_map[b]=edge_map[b][1:]
 
-                    if w[j] in subdivide_inverse:
+                    if w[j] in subdivided_inverse:
                         edge_map[c]=subdivide_map[w[j]][-1:]*edge_map[c]
                         edge_map[b]=edge_map[b][:-1]
- 
-                elif e in subdivide:
-                    w=self.image(e)
-                    i=0
-                    while w[i] not in Dfinverse: i=i+1    
 
+                    lower_stratum.add(A.to_positive_letter(a))
+                    lower_stratum.add(A.to_positive_letter(c))
+                    stratum_s.add(A.to_positive_letter(b))
+ 
+                elif e in subdivided:
                     a=subdivide_map[e][0]
                     b=subdivide_map[e][1]
                     
                     edge_map[a]=subdivide_morph(w[:i])                
                     edge_map[b]=subdivide_morph(w[i:])
 
-                    if w[i] in subdivide:
+                    if w[i] in subdivided:
                         edge_map[a]=edge_map[a]*subdivide_map[w[i]][0:1]
                         edge_map[b]=edge_map[b][1:]
- 
-                elif e in subdivide_inverse:
-                    w=self.image(e)
-                    j=len(w)-1
-                    while w[j] not in Dfinverse: j=j-1
 
+                    lower_stratum.add(A.to_positive_letter(a))
+                    stratum_s.add(A.to_positive_letter(b))
+ 
+                elif e in subdivided_inverse:
                     a=subdivide_map[e][0]
                     b=subdivide_map[e][1]
                     
                     edge_map[a]=subdivide_morph(w[:j+1])                
                     edge_map[b]=subdivide_morph(w[j+1:])
 
-
-                    if w[j] in subdivide_inverse:
+                    if w[j] in subdivided_inverse:
                         edge_map[a]=edge_map[a][:-1]
                         edge_map[b]=subdivide_map[w[j]][-1:]*edge_map[b]
 
-                else:
-                    edge_map[subdivide_map[e][0]]=subdivide_morph(self.image(e))
+                    lower_stratum.add(A.to_positive_letter(b))
+                    stratum_s.add(A.to_positive_letter(a))
 
-            for i in xrange(len(self._strata)):
-                if i!=s:
-                    for e in self._strata[i]:
-                        edge_map[subdivide_map[e][0]]=subdivide_morph(self.image(e))
+                else:
+                    edge_map[e]=subdivide_morph(w)
+                    stratum_s.add(e)
+
+            # Edges of the other strata are not subdivided: only the
+            # images that cross a subdivided edge are rewritten
+            crossing=subdivided.union(subdivided_inverse)
+            for e in images:
+                if e not in stratum:
+                    if crossing.isdisjoint(letter_images[e]):
+                        edge_map[e]=images[e]
+                    else:
+                        edge_map[e]=subdivide_morph(images[e])
 
             self.set_edge_map(edge_map)
 
-
-            for i in xrange(len(self._strata)):
-                if i!=s:
-                    self._strata[i]=set(subdivide_map[e][0] for e in self._strata[i])
-
-            self._strata.insert(s,[])
-            stratum_s=[]
-
-            for e in self._strata[s+1]:
-
-                if e in subdivide and e in subdivide_inverse:
-                    self._strata[s].append(A.to_positive_letter(subdivide_map[e][0]))
-                    self._strata[s].append(A.to_positive_letter(subdivide_map[e][2]))
-                    stratum_s.append(A.to_positive_letter(subdivide_map[e][1]))
-                elif e in subdivide:
-                    self._strata[s].append(A.to_positive_letter(subdivide_map[e][0]))
-                    stratum_s.append(A.to_positive_letter(subdivide_map[e][1]))
-                elif e in subdivide_inverse:
-                    self._strata[s].append(A.to_positive_letter(subdivide_map[e][1]))
-                    stratum_s.append(A.to_positive_letter(subdivide_map[e][0]))
-                else:
-                    stratum_s.append(subdivide_map[e][0])
-
-            self._strata[s]=set(self._strata[s])
-            self._strata[s+1]=set(stratum_s)
+            self._strata[s]=stratum_s
+            self._strata.insert(s,lower_stratum)
 
 
             # Subdivide strata[s] into irreducible substrata:
@@ -2425,8 +2705,16 @@ class TopologicalRepresentative(GraphMap):
         The stratum of ``self`` that contains the edge ``e``.
         """
         e=self._domain.alphabet().to_positive_letter(e)
-        for s,stratum in enumerate(self._strata):
-            if e in stratum: return s
+        index=self._stratum_index
+        if index is not None and e in index:
+            s=index[e]
+            if s<len(self._strata) and e in self._strata[s]:
+                return s
+        # the strata have been changed since the index was built
+        index=dict((a,s) for s,stratum in enumerate(self._strata) for a in stratum)
+        self._stratum_index=index
+        if e in index:
+            return index[e]
         raise ValueError("%s not in alphabet"%e)
 
 
@@ -2831,69 +3119,18 @@ class TopologicalRepresentative(GraphMap):
                 multiple_preimages[vv].append(v)
             elif vv in preimage:
                 multiple_preimages[vv]=[preimage[vv],v]
-                v0=vv
                 done=False
             else:
                 preimage[vv]=v
 
         if done: return []
 
-        #Build a tree rooted at v0 that spans G and the list of remaining edges (loops)
-
-        tree={v0:['',v0]}
-        edges=A.positive_letters()
-        loops=[]
-
-        while len(edges)>0:
-            new_edges=[]
-            for a in edges:
-                v=G.initial_vertex(a)
-                vv=G.terminal_vertex(a)
-                if v in tree and vv in tree:
-                    loops.append(a)
-                elif v in tree:
-                    tree[vv]=[A.inverse_letter(a),v]
-                elif vv in tree:
-                    tree[v]=[a,vv]
-                else:
-                    new_edges.append(a)
-            edges=new_edges
-            
-        if verbose: 
-            print "Spanning tree: ",tree
-            print "Remaining edges: ",loops
-
-        #Build the list of paths to the root of the tree
-        rootpath={}
-        for v in tree:
-            u=[]
-            vv=v
-            [a,vvv]=tree[vv]
-            while vv!=v0: 
-                u.append(a)
-                vv=vvv
-                [a,vvv]=tree[vv]
-            rootpath[v]=Word(u)
-
-
-        #Build the automorphism of the free group on loops defined by self
-        B=AlphabetWithInverses(loops,[A.inverse_letter(a) for a in loops])
-        FB=FreeGroup(B)
-        
-        phi_map={}
-        for b in loops:
-            wb=G.reverse_path(rootpath[G.initial_vertex(b)])*Word([b])*rootpath[G.terminal_vertex(b)]
-            wwb=self(wb)
-            
-            phi_map[b]=FB(c for c in wwb if c in B)
-        phi=FreeGroupAutomorphism(phi_map,FB)
-
-        if verbose: print "Automorphism: ",phi
-
-        #We need the inverse
-
-        phi_inv=phi.inverse()
+        #Use a spanning tree of G, the list of remaining edges (loops) and
+        #the maps induced by self and its inverse on these loops
 
+        tree_edges,loops,rootpath,phi,phi_inv=self._loop_maps(verbose)
+        B=set(loops)
+        B.update(A.inverse_letter(a) for a in loops)
 
         #Build the list of paths from pairs of identified points of the border mapped to trivial paths 
         result=[]
@@ -2902,16 +3139,15 @@ class TopologicalRepresentative(GraphMap):
                 v1=vpreimages[i]
                 for j in xrange(i+1,len(vpreimages)):
                     v2=vpreimages[j]
-                    u1=rootpath[v1]
-                    u2=rootpath[v2]
+                    u1=rootpath(v1)
+                    u2=rootpath(v2)
                     w=self(G.reverse_path(u1)*u2)
-                    wB=FB(c for c in w if c in B)
-                    wwB=phi_inv(wB)
+                    wwB=phi_inv.path_image([c for c in w if c in B])
                     ww=Word([])
                     for b in wwB:
-                        ww=ww*G.reverse_path(rootpath[G.initial_vertex(b)])
+                        ww=ww*G.reverse_path(rootpath(G.initial_vertex(b)))
                         ww=ww*Word([b])
-                        ww=ww*rootpath[G.terminal_vertex(b)]
+                        ww=ww*rootpath(G.terminal_vertex(b))
                     ww=u1*ww*G.reverse_path(u2)
                     ww=G.reduce_path(ww)
                     result.append(ww)
@@ -2930,6 +3166,63 @@ class TopologicalRepresentative(GraphMap):
 
         return rresult
 
+    def _loop_maps(self,verbose=False):
+        """
+        The maps induced by ``self`` and by its homotopy inverse on the
+        rose obtained by collapsing a spanning tree of the graph.
+
+        OUTPUT:
+
+        A tuple ``(tree_edges,loops,rootpath,phi,phi_inv)`` where
+        ``tree_edges`` is the set of edges of the tree, ``loops`` the
+        list of the other positive edges, ``rootpath(v)`` the path in
+        the tree from ``v`` to the root, and ``phi`` and ``phi_inv`` are
+        ``GraphMap`` of the rose on ``loops``.
+
+        The maps are computed again at each call. Between two calls
+        the edge map is almost always changed by a fold, and carrying
+        the maps through it would need a homotopy inverse of each
+        fold, subdivision and contraction. The spanning tree and the
+        paths to the root are cached by the graph (see
+        ``GraphWithInverses.tree_path()``).
+
+        ALGORITHM:
+
+        The inverse is computed by folding, see ``GraphMap.inverse()``.
+        """
+        G=self._domain
+        A=G.alphabet()
+        root=G.initial_vertex(A[0]) # G may have isolated vertices
+
+        tree=G.maximal_tree(root)
+        tree_edges=set(tree)
+        loops=[a for a in A.positive_letters() if a not in tree_edges]
+
+        if verbose: 
+            print "Spanning tree: ",tree
+            print "Remaining edges: ",loops
+
+        rootpaths={}
+        def rootpath(v):
+            if v not in rootpaths:
+                rootpaths[v]=G.reverse_path(G.tree_path(v,root))
+            return rootpaths[v]
+
+        B=AlphabetWithInverses(loops,[A.inverse_letter(a) for a in loops])
+        B_letters=set(B)
+        rose=GraphWithInverses.rose_graph(B)
+        phi_map={}
+        for b in loops:
+            wb=G.reverse_path(rootpath(G.initial_vertex(b)))*Word([b])*rootpath(G.terminal_vertex(b))
+            phi_map[b]=[c for c in self(wb) if c in B_letters]
+        phi=GraphMap(rose,rose,phi_map)
+
+        if verbose: print "Automorphism: ",phi
+
+        phi_inv=phi.inverse()
+
+        return tree_edges,loops,rootpath,phi,phi_inv
+
     def fold_paths(self,paths,verbose):
         """
         Recursively fold the ``paths`` of ``self``. 
@@ -2950,6 +3243,21 @@ class TopologicalRepresentative(GraphMap):
         A=G.alphabet()
         result_morph=None
 
+        # The images are kept aside during the folds and the edge
+        # map of self is set once all the paths are folded.
+        images=_EdgeImages(self)
+
+        def foldable(node):
+            # True if the turn after node is folded by self
+            if node is path.head or not node.alive or node.next is None:
+                return False
+            u=images.ends(node.letter)
+            v=images.ends(node.next.letter)
+            return u is None or v is None or A.are_inverse(u[1],v[0])
+
+        def image_ends(w):
+            return (w[0],w[-1]) if len(w)>0 else None
+
         for p in paths:
             if result_morph:
                 p=G.reduce_path(result_morph(p))
@@ -2958,85 +3266,89 @@ class TopologicalRepresentative(GraphMap):
 
             # We need to cleverly choose the place to fold.  The
             # strategy is to fold all possible places in p starting
-            # with the oldest one. folds_order is the list of foldable
-            # places in p in that order.
+            # with the oldest one. folds_order is the queue of
+            # foldable places in p in that order: a place is given by
+            # the node of the path just before it.
+
+            path=_LinkedPath(p,A)
+            folds_order=deque()
+            for node in path:
+                if foldable(node):
+                    if images.ends(node.letter) is None or images.ends(node.next.letter) is None:
+                        folds_order.appendleft(node)
+                    else:
+                        folds_order.append(node)
+            queued=set(folds_order)
 
-            i=0
-            if len(p)>0:
-                u=self.image(p[0])
-            folds_order=[]
-            while i+1<len(p):
-                v=self.image(p[i+1])
-                if len(u)==0 or len(v)==0:
-                    folds_order.insert(0,i)
-                elif A.are_inverse(u[-1],v[0]):
-                    folds_order.append(i)
-                i=i+1
-                u=v
-                    
-            while len(p)>1: #because of previous foldings an edge can be contracted to a point
+            while len(path)>1: #because of previous foldings an edge can be contracted to a point
                 if verbose: 
-                    print "Fold path:",p,"order of folds to perform:",folds_order
-                
-                a=A.inverse_letter(p[folds_order[0]])
-                b=p[folds_order[0]+1]
-                u=self.image(a)
-                v=self.image(b)
+                    print "Fold path:",path.letters(),"number of folds to perform:",len(folds_order)
+
+                if len(folds_order)==0:
+                    raise ValueError("The path %s is not mapped to a trivial path"%path.letters())
+                node=path.resolve(folds_order[0])
+                if not foldable(node):
+                    queued.discard(folds_order.popleft())
+                    continue
+
+                a=A.inverse_letter(node.letter)
+                b=node.next.letter
+                u=images.image(a)
+                v=images.image(b)
                 cpl=G.common_prefix_length(u,v)
                 common_prefix=u[:cpl]
                 
                 if cpl==len(u) and cpl==len(v):
-                    folds_order[0]-=1
+                    queued.discard(folds_order[0])
+                    folds_order[0]=node.prev
+                    queued.add(node.prev)
                 else:
-                    i=folds_order.pop(0)
-                    if cpl==len(u) and i>0:
-                        u=self.image(p[i-1])
+                    queued.discard(folds_order.popleft())
+                    if cpl==len(u) and node.prev is not path.head:
+                        u=images.image(node.prev.letter)
                         if len(u)>0 and A.are_inverse(u[-1],v[cpl]): 
-                            if A.are_inverse(p[i-1],p[i+1]):
-                                folds_order.append(i-1)
+                            if A.are_inverse(node.prev.letter,node.next.letter):
+                                folds_order.append(node.prev)
                             else:
-                                folds_order.insert(0,i-1)
-                    elif cpl==len(v) and i+2<len(p):
-                        v=self.image(p[i+2])
+                                folds_order.appendleft(node.prev)
+                            queued.add(node.prev)
+                    elif cpl==len(v) and node.next.next is not None:
+                        v=images.image(node.next.next.letter)
                         if len(v)>0 and u[cpl]==v[0]:
-                            if A.are_inverse(p[i],p[i+2]):
-                                folds_order.append(i)
+                            if A.are_inverse(node.letter,node.next.next.letter):
+                                folds_order.append(node)
                             else:
-                                folds_order.insert(0,i)
-
-                fold_morph=self.fold((a,b),common_prefix,verbose=verbose)
-
-                q=G.reduce_path(fold_morph(p))
-                for i in xrange(len(folds_order)):
-                    u=G.reduce_path(fold_morph(p[:folds_order[i]+1]))
-                    folds_order[i]=G.common_prefix_length(u,q)-1
-
-                p=q
-                
-                if len(p)>1:
-                    u=self.image(p[0])
-                i=0
-                folds=set()
-                for i in xrange(len(p)-1):
-                    v=self.image(p[i+1])
-                    if len(u)==0 or len(v)==0 or A.are_inverse(u[-1],v[0]):
-                        folds.add(i)
-                    u=v
-
-                new_folds_order=[]
-                for i in folds_order:
-                    if i in folds:
-                        new_folds_order.append(i)
-                        folds.remove(i)
-                for i in folds:
-                    new_folds_order.append(i)
-
-                folds_order=new_folds_order
+                                folds_order.appendleft(node)
+                            queued.add(node)
+
+                images.log=dict()
+                fold_morph=self._fold_images(images,(a,b),common_prefix,verbose=verbose)
+
+                # Rewrite the path around the folded edges, then look for
+                # new foldable places, in the order of the path, where
+                # the path or the ends of the images of its edges have
+                # changed
+                sites=path.rewrite(fold_morph)
+                for pa,w in images.log.iteritems():
+                    if pa in path.nodes and (w is None or image_ends(w)!=images.ends(pa)):
+                        for n in path.nodes[pa]:
+                            sites.append(n.prev)
+                            sites.append(n)
+                images.log=None
+                sites=set(path.resolve(n) for n in sites)
+                for n in sorted(sites,key=lambda n: n.label):
+                    if n not in queued and foldable(n):
+                        folds_order.append(n)
+                        queued.add(n)
 
                 if result_morph:
                     result_morph=fold_morph*result_morph
                 else:
                     result_morph=fold_morph
+
+        if result_morph:
+            self.set_edge_map(images.images,images.changed)
+            if verbose: print "\n",self
     
         tails=self._domain.find_tails()
         if len(tails)>0:
@@ -3117,6 +3429,9 @@ class TopologicalRepresentative(GraphMap):
         while not done:
             done=True
 
+            if A.holes()>len(A):
+                result_morph=self.compact_alphabet(verbose)*result_morph
+
             if verbose:
                 print "Expansion factors:",self.relative_expansion_factors()
 
@@ -3423,3 +3738,485 @@ class TopologicalRepresentative(GraphMap):
 
 
         return result_morph
+
+
+class TurnIndex(object):
+    """
+    Index of the turns that occur in the images of the edges of a
+    topological representative.
+
+    A turn ``(x,y)`` (ordered with respect to the ``less_letter()``
+    function of the alphabet) occurs in the image ``w`` of the edge
+    ``e`` at position ``i`` if ``{x,y}`` is ``{inverse(w[i-1]),w[i]}``.
+    Only images of positive edges are indexed.
+
+    The index is updated by ``update()``, which only re-scans the
+    images of the new edges and of the edges recorded by
+    ``invalidate()``.
+
+    SEE ALSO:
+
+    ``TopologicalRepresentative.turn_index()``
+    """
+
+    def __init__(self):
+        self._edge_map=None   # the indexed edge map
+        self._images={}       # edge -> indexed image
+        self._edge_turns={}   # edge -> set of turns in its image
+        self._occurrences={}  # turn -> {edge: list of positions}
+        self._changed=None    # edges whose image may have changed, None if unknown
+
+    def invalidate(self,edges=None):
+        """
+        Records that the images of the positive ``edges`` may have
+        changed. If ``edges`` is ``None``, all the images may have
+        changed.
+        """
+        if edges is None or self._changed is None:
+            self._changed=None
+        else:
+            self._changed.update(edges)
+
+    def update(self,edge_map,images,A):
+        """
+        Updates ``self`` to the ``images`` (a dictionary of tuples) of
+        the edge map ``edge_map`` of a graph with alphabet ``A``.
+
+        If the edges whose image may have changed are not known, the
+        images are compared with the indexed ones.
+        """
+        for e in self._images.keys():
+            if e not in A or not A.is_positive_letter(e):
+                self._remove(e)
+        if self._changed is None:
+            changed=[e for e in A.positive_letters() if self._images.get(e)!=images[e]]
+        else:
+            changed=[e for e in self._changed if e in self._images]
+            changed.extend(e for e in A.positive_letters() if e not in self._images)
+        for e in changed:
+            if e in self._images:
+                self._remove(e)
+            self._add(e,images[e],A)
+        self._edge_map=edge_map
+        self._changed=set()
+
+    def _add(self,e,w,A):
+        """
+        Indexes the turns of the image ``w`` of ``e``.
+        """
+        occurrences=self._occurrences
+        turns=set()
+        for i in xrange(len(w)-1):
+            x=A.inverse_letter(w[i])
+            y=w[i+1]
+            t=(y,x) if A.less_letter(y,x) else (x,y)
+            turns.add(t)
+            if t not in occurrences:
+                occurrences[t]={e:[i+1]}
+            elif e not in occurrences[t]:
+                occurrences[t][e]=[i+1]
+            else:
+                occurrences[t][e].append(i+1)
+        self._images[e]=w
+        self._edge_turns[e]=turns
+
+    def _remove(self,e):
+        """
+        Removes the turns of the image of ``e`` from the index.
+        """
+        occurrences=self._occurrences
+        for t in self._edge_turns.pop(e):
+            del occurrences[t][e]
+            if len(occurrences[t])==0:
+                del occurrences[t]
+        del self._images[e]
+
+    def turns(self):
+        """
+        The list of the turns that occur in the images of the edges.
+        """
+        return self._occurrences.keys()
+
+    def occurrences(self,t):
+        """
+        A dictionary that maps the edges in the image of which the
+        turn ``t`` occurs to the increasing list of the positions.
+        """
+        return self._occurrences.get(t,{})
+
+    def positions(self,t,e):
+        """
+        The increasing list of the positions of the turn ``t`` in the
+        image of the positive edge ``e``.
+        """
+        return self._occurrences.get(t,{}).get(e,[])
+
+    def image_length(self,e):
+        """
+        The length of the indexed image of the positive edge ``e``.
+        """
+        return len(self._images[e])
+
+    def frequencies(self):
+        """
+        A dictionary that maps each turn to its number of occurrences
+        in the images of the edges.
+        """
+        return dict((t,sum(len(p) for p in occ.itervalues())) for t,occ in self._occurrences.iteritems())
+
+
+class _PathNode(object):
+    """
+    A letter of a ``_LinkedPath``.
+    """
+    __slots__=('letter','prev','next','alive','label')
+
+    def __init__(self,letter,prev=None,next=None,label=0):
+        self.letter=letter
+        self.prev=prev
+        self.next=next
+        self.alive=True
+        self.label=label
+
+
+class _LinkedPath(object):
+    """
+    A reduced edge path stored as a doubly linked list of nodes,
+    together with the index of the nodes of each edge.
+
+    Nodes are stable handles on the path: a node rewritten by
+    ``rewrite()`` stands for the last letter of its image, and a
+    removed node stands for the nearest node before it that is still
+    in the path (see ``resolve()``). The node ``head`` stands for the
+    point before the first letter.
+
+    Nodes carry increasing integer labels so that nodes can be sorted
+    along the path without walking it.
+
+    For internal use by ``TopologicalRepresentative.fold_paths()``.
+    """
+
+    GAP=1<<20 # initial gap between the labels of consecutive nodes
+
+    def __init__(self,path,A):
+        self._alphabet=A
+        self.head=_PathNode(None)
+        self.length=0
+        self.nodes=dict() # positive letter -> set of nodes
+        node=self.head
+        for a in path:
+            node=self._insert_after(node,a)
+
+    def _insert_after(self,node,a):
+        if node.next is None:
+            label=node.label+self.GAP
+        else:
+            label=(node.label+node.next.label)//2
+            if label==node.label:
+                self._relabel()
+                label=(node.label+node.next.label)//2
+        new=_PathNode(a,node,node.next,label)
+        if node.next is not None:
+            node.next.prev=new
+        node.next=new
+        self._index(new)
+        self.length+=1
+        return new
+
+    def _relabel(self):
+        label=0
+        for node in self:
+            label+=self.GAP
+            node.label=label
+
+    def _index(self,node):
+        pa=self._alphabet.to_positive_letter(node.letter)
+        if pa in self.nodes:
+            self.nodes[pa].add(node)
+        else:
+            self.nodes[pa]=set([node])
+
+    def _unindex(self,node):
+        pa=self._alphabet.to_positive_letter(node.letter)
+        self.nodes[pa].discard(node)
+        if len(self.nodes[pa])==0:
+            del self.nodes[pa]
+
+    def _unlink(self,node):
+        node.alive=False
+        node.prev.next=node.next
+        if node.next is not None:
+            node.next.prev=node.prev
+        self.length-=1
+
+    def _remove(self,node):
+        self._unlink(node)
+        self._unindex(node)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        node=self.head.next
+        while node is not None:
+            yield node
+            node=node.next
+
+    def letters(self):
+        """
+        The path as a list of edges.
+        """
+        return [node.letter for node in self]
+
+    def resolve(self,node):
+        """
+        The node of the path that stands for ``node``.
+        """
+        while not node.alive:
+            node=node.prev
+        return node
+
+    def rewrite(self,morph):
+        """
+        Replaces each edge ``a`` of the path by ``morph.image(a)`` and
+        reduces the result.
+
+        Only the nodes of the edges that are not fixed by ``morph``
+        are visited. These edges may no longer be letters of the
+        alphabet.
+
+        OUTPUT:
+
+        The list of the nodes around which the path has changed.
+        """
+        changed=[]
+        for pa in self.nodes.keys():
+            image=morph.image(pa)
+            if len(image)!=1 or image[0]!=pa:
+                changed.extend(self.nodes.pop(pa))
+        sites=[]
+        for node in changed:
+            image=morph.image(node.letter)
+            before=node.prev
+            sites.append(before)
+            if len(image)==0:
+                self._unlink(node)
+                continue
+            left=before
+            for a in image[:-1]:
+                left=self._insert_after(left,a)
+                sites.append(left)
+            node.letter=image[-1]
+            self._index(node)
+            sites.append(node)
+        # reduce from left to right, as a stack would do
+        sites=[self.resolve(node) for node in sites]
+        sites.sort(key=lambda node: node.label)
+        return [self.cancel(self.resolve(node)) for node in sites]
+
+    def cancel(self,left):
+        """
+        Cancels the inverse letters around the junction after the
+        node ``left``.
+
+        OUTPUT:
+
+        The node before the junction once reduced.
+        """
+        A=self._alphabet
+        while left is not self.head and left.next is not None and A.are_inverse(left.letter,left.next.letter):
+            right=left.next
+            new_left=left.prev
+            self._remove(right)
+            self._remove(left)
+            left=new_left
+        return left
+
+
+class _EdgeImages(object):
+    """
+    The images of the edges of a topological representative, kept
+    aside while a sequence of folds and subdivisions is performed.
+
+    Only the images of the positive edges are stored, together with
+    the index of the edges whose image crosses each edge, so that a
+    fold or a subdivision rewrites only the images that it changes.
+    The turns of the images are indexed in ``turn_index`` (a
+    ``TurnIndex``). The edge map of the topological representative is
+    set once at the end from ``images``.
+
+    The positive edges whose images have been set or removed are
+    recorded in ``changed``. If ``log`` is a dictionary, each positive
+    edge whose image is changed is also recorded in ``log`` with its
+    previous image (``None`` for a new edge), until ``log`` is reset.
+
+    For internal use by ``TopologicalRepresentative.multifold()`` and
+    ``TopologicalRepresentative.fold_paths()``.
+    """
+
+    def __init__(self,f):
+        G=f._domain
+        A=G.alphabet()
+        self._graph=G
+        self.images=dict()
+        self._inverse=dict() # negative letter -> positive letter
+        self._crossing=dict() # positive edge -> set of the edges whose image crosses it
+        self._crosses=dict() # positive edge -> set of the edges its image crosses
+        self.turn_index=TurnIndex()
+        self.log=None
+        self.changed=set()
+        for a in A.positive_letters():
+            self._set(a,f.image(a))
+        self.changed.clear()
+
+    def _set(self,a,w):
+        A=self._graph.alphabet()
+        if self.log is not None and a not in self.log:
+            self.log[a]=self.images.get(a)
+        self.changed.add(a)
+        if a in self.images:
+            self._unset(a)
+        self.images[a]=w
+        self._inverse[A.inverse_letter(a)]=a
+        self.turn_index._add(a,w,A)
+        crosses=set(A.to_positive_letter(b) for b in w)
+        self._crosses[a]=crosses
+        for b in crosses:
+            if b in self._crossing:
+                self._crossing[b].add(a)
+            else:
+                self._crossing[b]=set([a])
+
+    def _unset(self,a):
+        for b in self._crosses.pop(a):
+            if b in self._crossing:
+                self._crossing[b].discard(a)
+        self.turn_index._remove(a)
+        del self.images[a]
+
+    def image(self,a):
+        """
+        The image of the edge ``a``.
+        """
+        if a in self.images:
+            return self.images[a]
+        return self._graph.reverse_path(self.images[self._inverse[a]])
+
+    def ends(self,a):
+        """
+        The first and last edges of the image of the edge ``a``, or
+        ``None`` if this image is trivial.
+        """
+        if a in self.images:
+            w=self.images[a]
+            return (w[0],w[-1]) if len(w)>0 else None
+        w=self.images[self._inverse[a]]
+        if len(w)==0:
+            return None
+        A=self._graph.alphabet()
+        return (A.inverse_letter(w[-1]),A.inverse_letter(w[0]))
+
+    def __call__(self,path):
+        """
+        The reduced image of ``path``.
+        """
+        return self._graph.reduce_path([b for a in path for b in self.image(a)])
+
+    def set_image(self,a,w):
+        """
+        Sets the image of the edge ``a`` (positive or negative) to the
+        reduced path of ``w``.
+        """
+        G=self._graph
+        A=G.alphabet()
+        w=G.reduce_path(w)
+        if A.is_positive_letter(a):
+            self._set(a,w)
+        else:
+            self._set(A.inverse_letter(a),G.reverse_path(w))
+
+    def remove(self,a):
+        """
+        Forgets the image of the positive edge ``a``, which is no
+        longer an edge of the graph.
+        """
+        if self.log is not None and a not in self.log:
+            self.log[a]=self.images.get(a)
+        self.changed.add(a)
+        if a in self.images:
+            self._unset(a)
+        self._crossing.pop(a,None)
+
+    def crossing(self,edges):
+        """
+        The set of the positive edges whose images cross one of the
+        positive ``edges``.
+        """
+        result=set()
+        for a in edges:
+            result.update(self._crossing.get(a,()))
+        return result
+
+
+class _PathView(object):
+    """
+    The letters ``path[start:stop]`` of the path ``path``, not copied.
+
+    The searches of Nielsen paths cut the common prefix of the images
+    of their two paths at each step. These tails are only read,
+    compared and concatenated to the image of the next edge: they are
+    views on the image. Slicing a view gives a view on the same
+    path. Concatenation (``*``) copies the letters in a new ``Word``.
+
+    For internal use by ``TopologicalRepresentative.indivisible_nielsen_paths()``,
+    ``TopologicalRepresentative.periodic_nielsen_paths()`` and
+    ``TopologicalRepresentative.relative_indivisible_nielsen_paths()``.
+
+    EXAMPLES::
+
+    sage: v=_PathView(Word("abcAB"),1)
+    sage: len(v), v[0], v[-1]
+    (4, 'b', 'B')
+    sage: v[1:3]*Word("d")
+    word: cAd
+    """
+    __slots__=('_path','_start','_stop')
+
+    def __init__(self,path,start=0,stop=None):
+        if stop is None:
+            stop=len(path)
+        if isinstance(path,_PathView):
+            start,stop=path._start+start,path._start+stop
+            path=path._path
+        self._path=path
+        self._start=start
+        self._stop=stop
+
+    def __len__(self):
+        return self._stop-self._start
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            start,stop,step=i.indices(len(self))
+            if step!=1:
+                return Word(list(self))[i]
+            return _PathView(self,start,max(start,stop))
+        if i<0:
+            i+=len(self)
+        if i<0 or i>=len(self):
+            raise IndexError("path index out of range")
+        return self._path[self._start+i]
+
+    def __iter__(self):
+        path=self._path
+        for i in xrange(self._start,self._stop):
+            yield path[i]
+
+    def __mul__(self,other):
+        return Word(list(self)+list(other))
+
+    def __str__(self):
+        return str(Word(list(self)))
+
+    def __repr__(self):
+        return repr(Word(list(self)))